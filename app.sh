@@ -21,11 +21,25 @@ case "$COMMAND" in
   validate)
     python main.py validate
     ;;
+  status)
+    python main.py status
+    ;;
   lint)
-    pylint cleany/ main.py
+    pylint cleany/ benchmarks/ tests/ main.py
+    ;;
+  test)
+    python -m pytest tests/ "${@:2}"
+    ;;
+  bench)
+    python -m benchmarks.scheduler "${@:2}"
+    ;;
+  bench-serializers)
+    python -m benchmarks.serializers "${@:2}"
     ;;
   reset)
-    rm it.json rooms.json users.json
+    rm -f it.json rooms.json users.json
+    rm -f it.json.journal rooms.json.journal users.json.journal cleany.db cleany.db-wal cleany.db-shm
+    rm -f history.jsonl history.jsonl.snapshot history.jsonl.columns cleany.lock
     ;;
   android)
     case "$2" in
@@ -48,7 +62,10 @@ case "$COMMAND" in
         adb push users.json /sdcard/
         ;;
       reset)
-        adb shell rm /sdcard/rooms.json /sdcard/it.json /sdcard/users.json
+        adb shell rm -f /sdcard/rooms.json /sdcard/it.json /sdcard/users.json
+        adb shell rm -f /sdcard/rooms.json.journal /sdcard/it.json.journal /sdcard/users.json.journal
+        adb shell rm -f /sdcard/cleany.db /sdcard/cleany.db-wal /sdcard/cleany.db-shm
+        adb shell rm -f /sdcard/history.jsonl /sdcard/history.jsonl.snapshot /sdcard/history.jsonl.columns
         ;;
       *)
         echo "Unknown android command: $2"
@@ -0,0 +1,17 @@
+"""
+Benchmarks, run from the repository root with python -m benchmarks.<name>
+"""
+
+import json
+
+
+def write_results(results, output=None):
+    """
+    Print a benchmark's results as JSON, or write them to the file ``output``.
+    """
+    raw = json.dumps(results, indent=2)
+    if output:
+        with open(output, "w", encoding="utf-8") as file:
+            file.write(raw + "\n")
+    else:
+        print(raw)
@@ -0,0 +1,216 @@
+"""
+Scheduler benchmark: generates households of various sizes, seeds them, and
+simulates years of task completions through cleany.engine, for each storage mode.
+
+Bytes written are counted for the JSON state files; with sqlite storage only
+the resulting size on disk is reported. Results are printed (or written with
+--output) as JSON, to compare runs:
+
+    python -m benchmarks.scheduler --sizes 10 100 1000 --output before.json
+"""
+
+import argparse
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import os
+import platform
+import random
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+import yaml
+
+from benchmarks import write_results
+from cleany import engine, metrics, storage
+
+SIZES = (10, 100, 1000)
+STORAGES = ("json", "journal", "sqlite")
+PERIODS = ("1d", "3d", "1w", "2w", "1m")
+TASKS_PER_ROOM = 3
+DAYS = 730
+MAX_COMPLETIONS = 1000
+# Share of completions done by someone other than the assigned user
+SWAP_RATE = 0.1
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           engine.SCHEMA_FILENAME)
+
+
+def generate_tasks(size, storage_mode, seed=0):
+    """
+    Return a tasks.yaml document with ``size`` rooms and users, and
+    TASKS_PER_ROOM tasks per room.
+    """
+    rng = random.Random(seed)
+    users = [f"user{i}" for i in range(max(size, 2))]
+    rooms = {}
+    for i in range(size):
+        room_users = rng.sample(users, min(len(users), rng.randint(2, 4)))
+        tasks = {}
+        for j in range(TASKS_PER_ROOM):
+            period = rng.choice(PERIODS)
+            if j == 0:
+                tasks[f"task{j}"] = period
+            elif j == 1:
+                tasks[f"task{j}"] = {"period": period, "stagger": f"{rng.randint(1, 3)}d"}
+            else:
+                tasks[f"task{j}"] = {"period": period, "users": room_users[:2]}
+        rooms[f"room{i}"] = {"users": room_users, "tasks": tasks}
+    indefinite_tasks = {f"chore{i}": {"users": rng.sample(users, 2),
+                                      "repetitions": rng.randint(1, 5)}
+                        for i in range(max(size // 10, 1))}
+    return {"users": users, "rooms": rooms, "indefinite_tasks": indefinite_tasks,
+            "location": {"lat": 38.7, "lon": -9.1}, "storage": storage_mode}
+
+
+@contextmanager
+def _count_writes():
+    # Tally the bytes written per state file, by wrapping the storage's write function
+    written = {}
+    write_file = storage.write_file
+
+    def counting_write_file(filename, raw, append=False):
+        name = os.path.basename(filename)
+        written[name] = written.get(name, 0) + len(raw)
+        write_file(filename, raw, append)
+
+    storage.write_file = counting_write_file
+    try:
+        yield written
+    finally:
+        storage.write_file = write_file
+
+
+def _timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def _peak_memory(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _state_size():
+    # Bytes on disk of the state files in the working directory
+    return sum(os.path.getsize(name) for name in os.listdir(".")
+               if name not in (engine.TASKS_FILENAME, engine.SCHEMA_FILENAME)
+               and not name.endswith(".cache") and os.path.isfile(name))
+
+
+def _simulate(state, clock, days, max_completions, rng):
+    # Each simulated day, complete whatever fell due, sometimes as a different user
+    latencies = []
+    day = 0
+    start = clock[0]
+    while day < days and len(latencies) < max_completions:
+        today = clock[0].date()
+        for task in state.assigned_tasks.next_due(len(state.assigned_tasks)):
+            if task.due_date > today or len(latencies) >= max_completions:
+                break
+            users = state.find_users_for_task(task, False)
+            begin = time.perf_counter()
+            if len(users) > 1 and rng.random() < SWAP_RATE:
+                state.complete_task_as(task, rng.choice([u for u in users if u != task.user]),
+                                       False)
+            else:
+                state.complete_task(task)
+            latencies.append(time.perf_counter() - begin)
+        if state.indefinite_tasks and len(latencies) < max_completions:
+            begin = time.perf_counter()
+            state.complete_indefinite_task(rng.choice(state.indefinite_tasks).name)
+            latencies.append(time.perf_counter() - begin)
+        day += 1
+        clock[0] = start + timedelta(days=day)
+    return latencies, day
+
+
+def run(size, storage_mode, days=DAYS, max_completions=MAX_COMPLETIONS, seed=0):
+    """
+    Benchmark one household size with one storage mode, returning the measurements.
+    """
+    # pylint: disable=too-many-locals
+    workdir = tempfile.mkdtemp(prefix="cleany-bench-")
+    cwd = os.getcwd()
+    try:
+        os.chdir(workdir)
+        shutil.copy(SCHEMA_PATH, engine.SCHEMA_FILENAME)
+        with open(engine.TASKS_FILENAME, "w", encoding="utf-8") as file:
+            yaml.safe_dump(generate_tasks(size, storage_mode, seed), file)
+
+        doc, config_load = _timed(engine.load_config)
+        clock = [datetime(2024, 1, 1, 9)]
+        with _count_writes() as seed_written:
+            state, seed_time = _timed(lambda: engine.Engine(doc, now=lambda: clock[0]))
+        state.close()
+
+        state, load_time = _timed(lambda: engine.Engine(doc, now=lambda: clock[0]))
+        with _count_writes() as written:
+            latencies, simulated_days = _simulate(state, clock, days, max_completions,
+                                                  random.Random(seed))
+        state.close()
+        state_size = _state_size()
+        peak = _peak_memory(lambda: engine.Engine(doc, now=lambda: clock[0]).close())
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "size": size,
+        "storage": storage_mode,
+        "tasks": size * TASKS_PER_ROOM,
+        "config_load_s": config_load,
+        "seed_s": seed_time,
+        "seed_bytes_written": sum(seed_written.values()),
+        "load_s": load_time,
+        "load_peak_memory_bytes": peak,
+        "simulated_days": simulated_days,
+        "completions": len(latencies),
+        "completion_s": {
+            "mean": statistics.fmean(latencies) if latencies else None,
+            "p50": metrics.percentile(latencies, 0.5),
+            "p95": metrics.percentile(latencies, 0.95),
+            "max": max(latencies, default=None),
+        },
+        "bytes_written": written,
+        "bytes_per_completion": sum(written.values()) / len(latencies) if latencies else None,
+        "state_bytes_on_disk": state_size,
+    }
+
+
+def main():
+    """
+    Run the benchmark suite from the command line.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES,
+                        help="Numbers of rooms (and users) to generate.")
+    parser.add_argument("--storage", nargs="+", default=STORAGES,
+                        choices=("json", "journal", "sqlite"))
+    parser.add_argument("--days", type=int, default=DAYS, help="Days to simulate.")
+    parser.add_argument("--max-completions", type=int, default=MAX_COMPLETIONS,
+                        help="Stop simulating after this many completions.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results to this file instead of stdout.")
+    args = parser.parse_args()
+
+    results = {
+        "benchmark": "scheduler",
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "runs": [run(size, storage_mode, args.days, args.max_completions, args.seed)
+                 for size in args.sizes for storage_mode in args.storage],
+    }
+    write_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Serializer benchmark: encodes and decodes state snapshots of various sizes with
+each encoding installed here, reporting throughput and size, to pick a
+state_format per device. The "json" row decodes with the stdlib's json, although
+the app reads JSON with orjson whenever it is installed, so that it compares with
+the "orjson" row. Results are printed (or written with --output) as JSON:
+
+    python -m benchmarks.serializers --sizes 100 10000 --output serializers.json
+"""
+
+import argparse
+from datetime import date, datetime
+import json
+import platform
+import random
+import time
+
+from benchmarks import write_results
+from cleany import serializers
+
+SIZES = (100, 1000, 10000)
+REPEAT = 5
+PERIODS = ("1d", "3d", "1w", "2w", "1m")
+
+
+def generate_snapshot(size, seed=0):
+    """
+    Return a snapshot of ``size`` assigned tasks, laid out as data.Schedule stores them.
+    """
+    rng = random.Random(seed)
+    today = date.today().toordinal()
+    return [{"user": f"user{rng.randrange(max(size // 3, 2))}", "room": f"room{i // 3}",
+             "name": f"task{i % 3}", "due_date": today + rng.randint(-5, 30),
+             "period": rng.choice(PERIODS)} for i in range(size)]
+
+
+def _best(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(size, name, repeat=REPEAT):
+    """
+    Benchmark one snapshot size with one encoding, returning the measurements.
+    """
+    serializer = serializers.SERIALIZERS[name]
+    doc = generate_snapshot(size)
+    raw = serializer.dumps(doc)
+    assert serializers.detect(raw).loads(raw) == doc
+    dumps = _best(lambda: serializer.dumps(doc), repeat)
+    if name == "json":
+        loads = _best(lambda: json.loads(raw), repeat)
+    else:
+        loads = _best(lambda: serializer.loads(raw), repeat)
+    return {
+        "size": size,
+        "state_format": name,
+        "decoder": "json" if name == "json" else name,
+        "bytes": len(raw),
+        "dumps_s": dumps,
+        "loads_s": loads,
+        "dumps_mb_per_s": len(raw) / dumps / 1e6,
+        "loads_mb_per_s": len(raw) / loads / 1e6,
+    }
+
+
+def main():
+    """
+    Run the benchmark suite from the command line.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES,
+                        help="Numbers of tasks in the snapshot.")
+    parser.add_argument("--formats", nargs="+", default=serializers.available(),
+                        choices=list(serializers.SERIALIZERS),
+                        help="Encodings to compare, all those installed by default.")
+    parser.add_argument("--repeat", type=int, default=REPEAT,
+                        help="Runs to take the best time of.")
+    parser.add_argument("--output", help="Write the results to this file instead of stdout.")
+    args = parser.parse_args()
+
+    missing = [name for name in args.formats if name not in serializers.available()]
+    if missing:
+        parser.error(f"not installed: {', '.join(missing)}")
+    results = {
+        "benchmark": "serializers",
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "runs": [run(size, name, args.repeat) for size in args.sizes for name in args.formats],
+    }
+    write_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -24,11 +24,11 @@ source.include_exts = py,png,jpg,kv,atlas,json
 #source.exclude_exts = spec,json,yaml
 
 # (list) List of directory to exclude (let empty to not exclude anything)
-source.exclude_dirs = bin,venv,.buildozer
+source.exclude_dirs = bin,venv,.buildozer,__schemacache__,benchmarks
 
 # (list) List of exclusions using pattern matching
 # Do not prefix with './'
-source.exclude_patterns = __pycache__,requirements.txt,.gitignore,it.json,rooms.json
+source.exclude_patterns = __pycache__,requirements.txt,.gitignore,it.json,rooms.json,metrics.json,cleany.lock
 
 # (str) Application versioning (method 1)
 version = 0.1
@@ -0,0 +1,239 @@
+"""
+Household analytics over the completion history: completions per user, and
+on-time rates and lateness per room, over any window of time.
+
+The history is loaded into columns (one array per field, names replaced by ids),
+which are cached next to the log, so a report only parses the events logged
+since the last one. The group-bys run on NumPy if it is installed, and in a
+single pass over the arrays otherwise.
+"""
+
+from array import array
+from collections import namedtuple
+from datetime import date
+import json
+import logging
+
+from .storage import write_file
+
+try:
+    import numpy # pylint: disable=import-error
+except ImportError:
+    numpy = None # pylint: disable=invalid-name
+
+COLUMNS_SUFFIX = ".columns"
+
+_KINDS = ("task", "indefinite", "score", "assign")
+_COMPLETIONS = (_KINDS.index("task"), _KINDS.index("indefinite"))
+_NO_DUE = 0
+
+# The cache layout: a JSON header line, then each column's raw bytes in this order
+_FIELDS = (("at", "d"), ("day", "i"), ("due", "i"), ("kind", "B"), ("user", "I"),
+           ("credited", "I"), ("room", "I"), ("task", "I"))
+_VERSION = 1
+
+UserStats = namedtuple("UserStats", ["user", "done", "for_others", "covered"])
+
+RoomStats = namedtuple("RoomStats", ["room", "done", "on_time", "overdue", "on_time_rate",
+                                     "avg_days_late"])
+
+_log = logging.getLogger(__name__)
+
+
+class Columns: # pylint: disable=too-many-instance-attributes
+    """
+    The completion events of a history log, as parallel arrays:
+
+    ``at``: unix time, ``day``: the local date it happened on (as an ordinal),
+    ``due``: the task's due date (as an ordinal, 0 for indefinite tasks and score
+    changes), ``kind``: an index into _KINDS, and ``user``, ``credited``, ``room``
+    and ``task``: indexes into ``names``. Room 0 is None, for indefinite tasks.
+    """
+    def __init__(self):
+        self.size = 0 # Bytes of the log loaded so far
+        self.names = {"user": [], "room": [None], "task": []}
+        self._ids = {field: {name: i for i, name in enumerate(names)}
+                     for field, names in self.names.items()}
+        self.at = array("d")
+        self.day = array("i")
+        self.due = array("i")
+        self.kind = array("B")
+        self.user = array("I")
+        self.credited = array("I")
+        self.room = array("I")
+        self.task = array("I")
+
+    def __len__(self):
+        return len(self.at)
+
+    def _id(self, field, name):
+        ids = self._ids[field]
+        if name not in ids:
+            ids[name] = len(self.names[field])
+            self.names[field].append(name)
+        return ids[name]
+
+    def append(self, event, size=None):
+        """
+        Add one event, as logged by history.History. ``size`` is the size of the
+        log up to its end, when it is added as it is logged (see History.listeners).
+        """
+        if size is not None:
+            self.size = size
+        self.at.append(event["at"])
+        self.day.append(date.fromtimestamp(event["at"]).toordinal())
+        self.due.append(event.get("due") or _NO_DUE)
+        self.kind.append(_KINDS.index(event["kind"]))
+        self.user.append(self._id("user", event["user"]))
+        self.credited.append(self._id("user", event["credited"]))
+        self.room.append(self._id("room", event["room"]))
+        self.task.append(self._id("task", event["task"]))
+
+    def update(self, filename):
+        """
+        Load the events logged to ``filename`` since the last update. Returns
+        whether there were any.
+        """
+        count = len(self)
+        try:
+            with open(filename, "rb") as file:
+                file.seek(self.size)
+                for line in file:
+                    if not line.endswith(b"\n"):
+                        break # Torn write at the tail of the log
+                    self.append(json.loads(line))
+                    self.size += len(line)
+        except FileNotFoundError:
+            pass
+        return len(self) > count
+
+    def dump(self):
+        """
+        Return the columns as bytes, see load_columns.
+        """
+        header = {"version": _VERSION, "size": self.size, "count": len(self),
+                  "names": self.names}
+        return b"".join([json.dumps(header).encode("utf-8") + b"\n"]
+                        + [getattr(self, field).tobytes() for field, _ in _FIELDS])
+
+    @classmethod
+    def from_bytes(cls, raw):
+        """
+        Return the Columns dumped to ``raw``.
+        """
+        end = raw.index(b"\n")
+        header = json.loads(raw[:end])
+        if header["version"] != _VERSION:
+            raise ValueError(f"Unknown columns version: {header['version']}")
+        columns = cls()
+        columns.size = header["size"]
+        columns.names = header["names"]
+        columns._ids = {field: {name: i for i, name in enumerate(names)}
+                        for field, names in columns.names.items()}
+        offset = end + 1
+        for field, typecode in _FIELDS:
+            column = array(typecode)
+            length = header["count"] * column.itemsize
+            column.frombytes(raw[offset:offset + length])
+            offset += length
+            setattr(columns, field, column)
+        return columns
+
+
+def load_columns(filename):
+    """
+    Return the Columns of the history log ``filename``, starting from the cached
+    columns and caching them again if more events were logged since.
+    """
+    cache = filename + COLUMNS_SUFFIX
+    try:
+        with open(cache, "rb") as file:
+            columns = Columns.from_bytes(file.read())
+        with open(filename, "rb") as file:
+            # Start over if the log has since been replaced or truncated
+            if file.seek(0, 2) < columns.size:
+                columns = Columns()
+    except (OSError, ValueError, KeyError):
+        columns = Columns()
+    if columns.update(filename):
+        try:
+            write_file(cache, columns.dump())
+        except OSError:
+            _log.exception("Analytics: failed to cache %s", cache)
+    return columns
+
+
+def _window(columns, start, end):
+    # The indexes of the completions (not score changes or assignments) between start and end
+    start = float("-inf") if start is None else start
+    end = float("inf") if end is None else end
+    if numpy is not None:
+        at = numpy.frombuffer(columns.at, dtype=numpy.float64)
+        kind = numpy.frombuffer(columns.kind, dtype=numpy.uint8)
+        return numpy.flatnonzero((at >= start) & (at < end) & numpy.isin(kind, _COMPLETIONS))
+    return [i for i, (at, kind) in enumerate(zip(columns.at, columns.kind))
+            if start <= at < end and kind in _COMPLETIONS]
+
+
+def user_stats(columns, start=None, end=None):
+    """
+    Return the UserStats of everyone in the history, between the unix times
+    ``start`` and ``end`` (both optional), most completions first: how many tasks
+    they did, how many of those for someone else, and how many of theirs someone
+    else did.
+    """
+    rows = _window(columns, start, end)
+    size = len(columns.names["user"])
+    if numpy is not None:
+        user = numpy.frombuffer(columns.user, dtype=numpy.uint32)[rows]
+        credited = numpy.frombuffer(columns.credited, dtype=numpy.uint32)[rows]
+        swapped = user != credited
+        done = numpy.bincount(credited, minlength=size).tolist()
+        for_others = numpy.bincount(credited[swapped], minlength=size).tolist()
+        covered = numpy.bincount(user[swapped], minlength=size).tolist()
+    else:
+        done, for_others, covered = [0] * size, [0] * size, [0] * size
+        for i in rows:
+            done[columns.credited[i]] += 1
+            if columns.user[i] != columns.credited[i]:
+                for_others[columns.credited[i]] += 1
+                covered[columns.user[i]] += 1
+    stats = [UserStats(name, done[i], for_others[i], covered[i])
+             for i, name in enumerate(columns.names["user"])]
+    return sorted(stats, key=lambda row: (-row.done, row.user))
+
+
+def room_stats(columns, start=None, end=None):
+    """
+    Return the RoomStats of each room with tasks completed between the unix
+    times ``start`` and ``end`` (both optional), sorted by room. A task is on time
+    if it was done by its due date (the days _queued_color shows it yellow or
+    green), and overdue after; lateness averages the days overdue, on time
+    counting as 0.
+    """
+    rows = _window(columns, start, end)
+    size = len(columns.names["room"])
+    if numpy is not None:
+        room = numpy.frombuffer(columns.room, dtype=numpy.uint32)[rows]
+        late = (numpy.frombuffer(columns.day, dtype=numpy.int32)[rows]
+                - numpy.frombuffer(columns.due, dtype=numpy.int32)[rows])
+        room, late = room[room != 0], late[room != 0]
+        done = numpy.bincount(room, minlength=size).tolist()
+        overdue = numpy.bincount(room[late > 0], minlength=size).tolist()
+        days_late = numpy.bincount(room, weights=numpy.maximum(late, 0),
+                                   minlength=size).tolist()
+    else:
+        done, overdue, days_late = [0] * size, [0] * size, [0] * size
+        for i in rows:
+            room = columns.room[i]
+            if room == 0:
+                continue
+            done[room] += 1
+            late = columns.day[i] - columns.due[i]
+            if late > 0:
+                overdue[room] += 1
+                days_late[room] += late
+    return sorted((RoomStats(name, done[i], done[i] - overdue[i], overdue[i],
+                             (done[i] - overdue[i]) / done[i], days_late[i] / done[i])
+                   for i, name in enumerate(columns.names["room"]) if done[i]),
+                  key=lambda row: row.room)
@@ -0,0 +1,151 @@
+"""
+Loading of the tasks.yaml configuration, with a cache of the parsed document.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+
+import yaml
+
+from . import schema, metrics
+from .storage import write_file
+
+CACHE_SUFFIX = ".cache"
+WATCH_INTERVAL = 2
+
+_log = logging.getLogger(__name__)
+
+
+def _read_cache(cache_path, key):
+    # JSON rather than pickle: on Android the cache sits in shared storage, where
+    # other apps could plant a file that would run code when unpickled
+    try:
+        with open(cache_path, "rb") as file:
+            cached = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cached, dict) or cached.get("key") != key:
+        return None
+    return cached["data"]
+
+
+@metrics.timed("config.load")
+def load(tasks_path, schema_path):
+    """
+    Return the parsed and validated configuration.
+
+    The validated document is cached as JSON next to the file
+    (``<tasks_path>.cache``), keyed by the file's size, mtime and content hash
+    along with the schema's, so later starts skip parsing and validation.
+    """
+    with open(tasks_path, "rb") as file:
+        raw = file.read()
+        stat = os.fstat(file.fileno())
+    with open(schema_path, "rb") as file:
+        schema_raw = file.read()
+    key = [stat.st_size, stat.st_mtime_ns, hashlib.sha256(raw).hexdigest(),
+           hashlib.sha256(schema_raw).hexdigest()]
+
+    cache_path = tasks_path + CACHE_SUFFIX
+    data = _read_cache(cache_path, key)
+    metrics.count("config.cache_hit" if data is not None else "config.cache_miss")
+    if data is None:
+        data = schema.load_yaml(raw)
+        schema.validate_yaml(data, schema_path)
+        try:
+            cached = json.dumps({"key": key, "data": data})
+            # Documents JSON can't hold as is (dates, non-string keys) aren't cached
+            if json.loads(cached)["data"] == data:
+                write_file(cache_path, cached.encode("utf-8"))
+        except (OSError, TypeError, ValueError):
+            pass # Caching is best effort
+    return data
+
+
+def signature(path):
+    """
+    Return the size and mtime of a file, which change whenever it is written,
+    or None if it does not exist.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+class Watcher:
+    """
+    Watches the configuration file from a background thread, and hands every
+    valid new version of it to ``callback`` (called on the watcher thread).
+    Versions that fail to parse or validate are logged and skipped.
+
+    ``poll``, if given, is also called on every check, to watch other files. It
+    keeps being called while the watcher is paused.
+    """
+
+    # pylint: disable=too-many-instance-attributes,too-many-arguments,too-many-positional-arguments
+    def __init__(self, tasks_path, schema_path, callback, interval=WATCH_INTERVAL, poll=None):
+        self.tasks_path = tasks_path
+        self.schema_path = schema_path
+        self.callback = callback
+        self.interval = interval
+        self.poll = poll
+        self._signature = signature(tasks_path)
+        self._paused = False
+        self._stopped = False
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="cleany-config-watcher",
+                                        daemon=True)
+
+    def start(self):
+        """
+        Start watching.
+        """
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop watching.
+        """
+        self._stopped = True
+        self._wake.set()
+
+    def pause(self):
+        """
+        Stop polling the file until resume() is called (``poll`` is still called).
+        """
+        self._paused = True
+
+    def resume(self):
+        """
+        Poll the file again, checking it right away.
+        """
+        self._paused = False
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(None if self._paused and not self.poll else self.interval)
+            self._wake.clear()
+            if self._stopped:
+                return
+            if not self._paused:
+                self._check()
+            if self.poll:
+                self.poll()
+
+    def _check(self):
+        current = signature(self.tasks_path)
+        if current is None or current == self._signature:
+            return
+        self._signature = current
+        try:
+            data = load(self.tasks_path, self.schema_path)
+        except (OSError, ValueError, yaml.YAMLError):
+            _log.exception("Config: ignoring invalid %s", self.tasks_path)
+            return
+        self.callback(data)
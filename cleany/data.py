@@ -2,22 +2,44 @@
 Task related data structures.
 """
 
-import json
-from datetime import datetime
+from contextlib import contextmanager
+from datetime import date
+import heapq
+from sys import intern
 
+from . import metrics
+from .storage import FileStorage
 
+_EPOCH = date(1970, 1, 1)
+
+
+def _to_date(value):
+    # Due dates are stored as ordinals, older files have them as "YYYY-MM-DD"
+    if isinstance(value, int):
+        return date.fromordinal(value)
+    return date.fromisoformat(value)
+
+
+# Records use __slots__ and share their (interned) strings, which keeps long
+# task histories small in memory.
 class _Task:
 
     # pylint: disable=too-few-public-methods
+    __slots__ = ("user", "room", "name", "due_date", "period")
+
     def __init__(self, dict1=None):
         self.user = ""
         self.room = ""
         self.name = ""
-        self.due_date = datetime.utcfromtimestamp(0).date()
+        self.due_date = _EPOCH
         self.period = ""
         if dict1:
-            self.__dict__.update(dict1)
-            self.due_date = datetime.strptime(self.due_date,'%Y-%m-%d').date()
+            self.user = intern(dict1.get("user", ""))
+            self.room = intern(dict1.get("room", ""))
+            self.name = intern(dict1.get("name", ""))
+            self.period = intern(dict1.get("period", ""))
+            if "due_date" in dict1:
+                self.due_date = _to_date(dict1["due_date"])
 
     def __lt__(self, other):
         return self.due_date < other.due_date
@@ -34,79 +56,393 @@ def new_task(user, room, name, due_date, period):
     :param str period: The period of the task
     """
     task = _Task()
-    task.user = user
-    task.room = room
-    task.name = name
+    task.user = intern(user)
+    task.room = intern(room)
+    task.name = intern(name)
     task.due_date = due_date
-    task.period = period
+    task.period = intern(period)
     return task
 
 
-# A solution for always persisting the state of the list in storage,
+def _insert_position(size, index):
+    # Where list.insert actually puts the value
+    if index < 0:
+        index = max(size + index, 0)
+    return min(index, size)
+
+
+# A solution for always persisting the state of the collections in storage,
 # not having to worry about application lifecycle, etc.
 # Works fine for this app because its low volume, infrequent read/writes.
-# Horrible idea for big data with frequent read/writes.
-class Tasks(list):
+# Journal mode keeps the per-change cost down to a small append for longer lists.
+class _Persisted:
     """
-    A means of collecting the tasks as a list, automatically managing their
-    persistence in storage. (That is, you treat it and a list, and the read/write to storage
-    gets taken care of automatically in the back end)
+    Mixin for a collection that reports every mutation to its storage backend.
     """
-    def __init__(self, filename):
+    def __init__(self, filename, storage):
         self.filename = filename
-        super().__init__(self._load())
+        self._storage = storage
+        self._batch_depth = 0
+        self._pending = []
+        self._metric = type(self).__name__.lstrip("_")
+        with metrics.timer(self._metric + ".load"):
+            super().__init__(self._load())
 
     def _load(self):
-        try:
-            with open(self.filename, "r", encoding="utf-8") as f:
-                return json.load(f, object_hook=_Task)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return []
+        raise NotImplementedError
+
+    def _dump(self):
+        raise NotImplementedError
+
+    def _replace(self, items):
+        # Swap in reloaded contents, without persisting them
+        raise NotImplementedError
+
+    @staticmethod
+    def _key(change):
+        # The record a change overwrites entirely, or None if it affects more than one
+        # pylint: disable=unused-argument
+        return None
+
+    def _coalesce(self, changes):
+        # Dirty tracking: only the last change to each record in a batch is kept.
+        # Changes affecting several records are kept, and end the merging.
+        kept = []
+        latest = {}
+        for change in changes:
+            key = self._key(change)
+            if key is None:
+                latest.clear()
+            else:
+                if key in latest:
+                    kept[latest[key]] = None
+                latest[key] = len(kept)
+            kept.append(change)
+        return [change for change in kept if change is not None]
 
     def _save(self):
-        with open(self.filename, "w", encoding="utf-8") as f:
-            json.dump(self, f, default=lambda o: o.__dict__ if isinstance(o, _Task) else str(o))
+        with metrics.timer(self._metric + ".save"):
+            self._storage.save(self._dump())
+
+    def _persist(self, *changes):
+        if self._batch_depth:
+            self._pending.extend(changes)
+            return
+        self._record(changes)
+
+    def _record(self, changes):
+        with metrics.timer(self._metric + ".record"):
+            self._storage.record(changes, self._dump)
+        metrics.count(self._metric + ".changes", len(changes))
+
+    @contextmanager
+    def batch(self):
+        """
+        Hold back persistence of the changes made inside the block,
+        and write them all at once when it exits. If the block raises, its
+        changes are dropped, and the collection reloaded as it was before.
+        Batches nest; only the outermost one writes or rolls back.
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._rollback()
+            raise
+        self._batch_depth -= 1
+        if self._batch_depth == 0 and self._pending:
+            changes, self._pending = self._pending, []
+            self._record(self._coalesce(changes))
+
+    def _rollback(self):
+        # Everything before the batch was handed to the storage, so reloading it
+        # (once queued writes are out) restores the contents the batch started from
+        self._pending = []
+        self._storage.flush()
+        with metrics.timer(self._metric + ".load"):
+            self._replace(self._load())
+
+    def changed(self):
+        """
+        Whether another process changed the stored collection since it was
+        last loaded or written.
+        """
+        return self._storage.changed()
+
+    def refresh(self):
+        """
+        Reload the collection if another process changed it. Returns whether it did.
+        """
+        if self._batch_depth or not self._storage.changed():
+            return False
+        with metrics.timer(self._metric + ".load"):
+            self._replace(self._load())
+        return True
+
+
+class _PersistedList(_Persisted, list):
+    """
+    A list that reports every mutation to its storage backend.
+    Subclasses define how their items are encoded to and decoded from JSON.
+
+    Unless a storage backend is given, the list is kept in ``filename``,
+    with ``options`` passed on to storage.FileStorage.
+    """
+    def __init__(self, filename, storage=None, **options):
+        super().__init__(filename, storage or FileStorage(filename, **options))
+
+    @staticmethod
+    def _encode(item):
+        return item
+
+    @staticmethod
+    def _decode(obj):
+        return obj
+
+    def _load(self):
+        doc, changes = self._storage.load()
+        items = [self._decode(obj) for obj in doc or []]
+        for change in changes:
+            self._replay(items, change)
+        return items
+
+    def _replay(self, items, change):
+        op = change[0]
+        if op == "set":
+            items[change[1]] = self._decode(change[2])
+        elif op == "insert":
+            items.insert(change[1], self._decode(change[2]))
+        elif op == "del":
+            del items[change[1]]
+        elif op == "extend":
+            items.extend(self._decode(obj) for obj in change[1])
+        elif op == "clear":
+            items.clear()
+        elif op == "reset":
+            items[:] = [self._decode(obj) for obj in change[1]]
+
+    def _dump(self):
+        return [self._encode(item) for item in self]
+
+    def _replace(self, items):
+        list.__setitem__(self, slice(None), items)
 
     def __setitem__(self, index, value):
         super().__setitem__(index, value)
-        self._save()
+        if isinstance(index, slice):
+            self._persist(["reset", self._dump()])
+        else:
+            self._persist(["set", index % len(self), self._encode(value)])
 
     def append(self, value):
         super().append(value)
-        self._save()
+        self._persist(["insert", len(self) - 1, self._encode(value)])
 
     def extend(self, iterable):
-        super().extend(iterable)
-        self._save()
+        values = list(iterable)
+        super().extend(values)
+        self._persist(["extend", [self._encode(value) for value in values]])
 
     def insert(self, index, value):
+        index = _insert_position(len(self), index)
         super().insert(index, value)
-        self._save()
+        self._persist(["insert", index, self._encode(value)])
 
     def remove(self, value):
-        super().remove(value)
-        self._save()
+        index = self.index(value)
+        super().__delitem__(index)
+        self._persist(["del", index, self._encode(value)])
 
     def pop(self, index=-1):
         value = super().pop(index)
-        self._save()
+        self._persist(["del", index % (len(self) + 1), self._encode(value)])
         return value
 
     def clear(self):
         super().clear()
-        self._save()
+        self._persist(["clear"])
+
+
+def _encode_task(task):
+    return {"user": task.user, "room": task.room, "name": task.name,
+            "due_date": task.due_date.toordinal(), "period": task.period}
+
+
+class Tasks(_PersistedList):
+    """
+    A means of collecting the tasks as a list, automatically managing their
+    persistence in storage. (That is, you treat it and a list, and the read/write to storage
+    gets taken care of automatically in the back end)
+    """
+    _encode = staticmethod(_encode_task)
+    _decode = staticmethod(_Task)
+
+
+class Schedule(_Persisted, dict):
+    """
+    The assigned tasks, as a mapping of (room, task name) to task, automatically
+    managing their persistence in storage.
+
+    Besides the mapping, tasks are kept in a priority queue ordered by due date
+    (ties in the order they were added), so completing or rescheduling a task
+    is O(log n) and the next k due tasks are found in O(k log k).
+    It reads the files written by Tasks, and its snapshots can be read by Tasks.
+    """
+    def __init__(self, filename, storage=None, **options):
+        self._heap = []
+        self._seq = 0
+        self._stale = 0
+        super().__init__(filename, storage or FileStorage(filename, **options))
+        for task in self.values():
+            self._push(task)
+
+    def _load(self):
+        doc, changes = self._storage.load()
+        tasks = {}
+        for obj in doc or []:
+            task = _Task(obj)
+            tasks[(task.room, task.name)] = task
+        for change in changes:
+            self._replay(tasks, change)
+        return tasks
+
+    @staticmethod
+    def _replay(tasks, change):
+        # Journals written by Tasks carry list indices, only the tasks themselves matter here
+        op = change[0]
+        if op in ("set", "insert"):
+            task = _Task(change[2])
+            # Re-added at the end, as the live schedule queues a replaced task anew
+            tasks.pop((task.room, task.name), None)
+            tasks[(task.room, task.name)] = task
+        elif op == "del" and len(change) > 2:
+            tasks.pop((change[2]["room"], change[2]["name"]), None)
+        elif op in ("extend", "reset"):
+            if op == "reset":
+                tasks.clear()
+            for obj in change[1]:
+                task = _Task(obj)
+                tasks[(task.room, task.name)] = task
+        elif op == "clear":
+            tasks.clear()
+
+    def _dump(self):
+        return [_encode_task(task) for task in self.ordered()]
+
+    @staticmethod
+    def _key(change):
+        if change[0] in ("set", "del"):
+            return change[2]["room"], change[2]["name"]
+        return None
+
+    def _replace(self, items):
+        dict.clear(self)
+        dict.update(self, items)
+        self._heap = []
+        self._stale = 0
+        for task in self.values():
+            self._push(task)
+
+    def _push(self, task):
+        self._seq += 1
+        heapq.heappush(self._heap, (task.due_date, self._seq, task))
+
+    def _is_live(self, entry):
+        task = entry[2]
+        return dict.get(self, (task.room, task.name)) is task
+
+    def _drop_stale(self):
+        # Removed tasks stay in the heap until they outnumber the live ones
+        self._stale += 1
+        if self._stale > len(self) + 64:
+            self._heap = [entry for entry in self._heap if self._is_live(entry)]
+            heapq.heapify(self._heap)
+            self._stale = 0
+
+    def __setitem__(self, key, task):
+        replaced = key in self
+        super().__setitem__(key, task)
+        self._push(task)
+        if replaced:
+            self._drop_stale()
+        self._persist(["set", None, _encode_task(task)])
+
+    def __delitem__(self, key):
+        task = self[key]
+        super().__delitem__(key)
+        self._drop_stale()
+        self._persist(["del", None, _encode_task(task)])
+
+    def pop(self, key, *default):
+        if key not in self:
+            return dict.pop(self, key, *default)
+        task = self[key]
+        del self[key]
+        return task
+
+    def update(self, *args, **kwargs):
+        for key, task in dict(*args, **kwargs).items():
+            self[key] = task
+
+    def add(self, task):
+        """
+        Schedule a task, replacing any task for the same room and name.
+        """
+        self[(task.room, task.name)] = task
+
+    def remove(self, task):
+        """
+        Unschedule a task.
+        """
+        del self[(task.room, task.name)]
+
+    def clear(self):
+        super().clear()
+        self._heap = []
+        self._stale = 0
+        self._persist(["clear"])
+
+    def next_due(self, k):
+        """
+        Return the k tasks that are due first, in due order.
+        """
+        heap = self._heap
+        found = []
+        # Walk the heap as a tree, always expanding the smallest entry seen so far
+        frontier = [(heap[0], 0)] if heap else []
+        while frontier and len(found) < k:
+            entry, i = heapq.heappop(frontier)
+            if self._is_live(entry):
+                found.append(entry[2])
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(heap):
+                    heapq.heappush(frontier, (heap[child], child))
+        return found
+
+    def ordered(self):
+        """
+        Return all tasks in due order.
+        """
+        return [entry[2] for entry in sorted(self._heap) if self._is_live(entry)]
 
 
 class _IndefiniteTask():
 
     # pylint: disable=too-few-public-methods
+    __slots__ = ("user", "name", "rep", "total_reps")
+
     def __init__(self, dict1=None):
         self.user = ""
         self.name = ""
         self.rep = -1
         self.total_reps = -1
         if dict1:
-            self.__dict__.update(dict1)
+            self.user = intern(dict1.get("user", ""))
+            self.name = intern(dict1.get("name", ""))
+            self.rep = dict1.get("rep", -1)
+            self.total_reps = dict1.get("total_reps", -1)
 
     def __lt__(self, other):
         return self.name < other.name
@@ -117,73 +453,66 @@ def new_indefinite_task(user, name, total_reps):
     Create a new indefinite task
     """
     it = _IndefiniteTask()
-    it.user = user
-    it.name = name
+    it.user = intern(user)
+    it.name = intern(name)
     it.rep = 1
     it.total_reps = total_reps
     return it
 
 
-class IndefiniteTasks(list):
+class IndefiniteTasks(_PersistedList):
     """
     A means of collecting the indefinite tasks as a list, automatically managing
     their persistence to storage. (That is, you treat it and a list, and the read/write to storage
     gets taken care of automatically in the back end)
-    """
-    def __init__(self, filename):
-        self.filename = filename
-        super().__init__(self._load())
-
-    def _load(self):
-        try:
-            with open(self.filename, "r", encoding="utf-8") as f:
-                return json.load(f, object_hook=_IndefiniteTask)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return []
-
-    def _save(self):
-        with open(self.filename, "w", encoding="utf-8") as f:
-            json.dump(self, f, default=lambda o: o.__dict__)
-
-    def __setitem__(self, index, value):
-        super().__setitem__(index, value)
-        self._save()
-
-    def append(self, value):
-        super().append(value)
-        self._save()
 
-    def extend(self, iterable):
-        super().extend(iterable)
-        self._save()
+    Tasks are looked up by name through a cache of their positions, and only the
+    last change to each task in a batch is persisted.
+    """
+    def __init__(self, filename, storage=None, **options):
+        self._positions = {}
+        super().__init__(filename, storage, **options)
 
-    def insert(self, index, value):
-        super().insert(index, value)
-        self._save()
+    @staticmethod
+    def _encode(item):
+        return {"user": item.user, "name": item.name, "rep": item.rep,
+                "total_reps": item.total_reps}
 
-    def remove(self, value):
-        super().remove(value)
-        self._save()
+    @staticmethod
+    def _decode(obj):
+        return _IndefiniteTask(obj)
 
-    def pop(self, index=-1):
-        value = super().pop(index)
-        self._save()
-        return value
+    @staticmethod
+    def _key(change):
+        return change[1] if change[0] == "set" else None
 
-    def clear(self):
-        super().clear()
-        self._save()
+    def index_of(self, name):
+        """
+        Return the position of the task named ``name``, or None if there is none.
+        """
+        # Positions are cached by name, and rebuilt when the cache turns out stale
+        i = self._positions.get(name)
+        if i is None or i >= len(self) or self[i].name != name:
+            self._positions = {task.name: i for i, task in enumerate(self)}
+            i = self._positions.get(name)
+        return i
+
+    def find(self, name):
+        """
+        Return the task named ``name``, or None if there is none.
+        """
+        i = self.index_of(name)
+        return None if i is None else self[i]
 
     def increment(self, name):
         """
         Increment the indefinite task's repetition
         """
-        # pylint: disable=consider-using-enumerate
-        for i in range(len(self)):
-            if self[i].name == name:
-                break
+        i = self.index_of(name)
+        if i is None:
+            raise KeyError(f"Indefinite task {name} wasnt found")
         self[i].rep += 1
-        self._save()
+        self._persist(["set", i, self._encode(self[i])])
         return i, self[i]
 
     def reset(self, index, new_user):
@@ -195,57 +524,70 @@ class IndefiniteTasks(list):
         """
         self[index].rep = 1
         self[index].user = new_user
-        self._save()
+        self._persist(["set", index, self._encode(self[index])])
 
 
 
-class _Users(dict):
+class _Users(_Persisted, dict):
     """
     A dictionary subclass that automatically persists data to a JSON file.
     Any modification to the dictionary updates the storage, ensuring
     consistency between in-memory data and disk.
     """
-    def __init__(self, filename):
-        self.filename = filename
-        super().__init__(self._load())
+    def __init__(self, filename, storage=None, **options):
+        options.setdefault("indent", 4)
+        super().__init__(filename, storage or FileStorage(filename, **options))
 
     def _load(self):
-        """Loads the dictionary from the JSON file."""
-        try:
-            with open(self.filename, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return {}
-
-    def _save(self):
-        """Saves the dictionary to the JSON file."""
-        with open(self.filename, "w", encoding="utf-8") as f:
-            json.dump(self, f, indent=4)
+        """Loads the dictionary from the JSON file, replaying any journaled changes."""
+        doc, changes = self._storage.load()
+        users = {intern(name): score for name, score in (doc or {}).items()}
+        for change in changes:
+            op = change[0]
+            if op == "set":
+                users[change[1]] = change[2]
+            elif op == "del":
+                users.pop(change[1], None)
+            elif op == "clear":
+                users.clear()
+        return users
+
+    def _dump(self):
+        return dict(self)
+
+    @staticmethod
+    def _key(change):
+        return change[1] if change[0] in ("set", "del") else None
+
+    def _replace(self, items):
+        dict.clear(self)
+        dict.update(self, items)
 
     def __setitem__(self, key, value):
         super().__setitem__(key, value)
-        self._save()
+        self._persist(["set", key, value])
 
     def __delitem__(self, key):
         super().__delitem__(key)
-        self._save()
+        self._persist(["del", key])
 
     def update(self, *args, **kwargs):
-        super().update(*args, **kwargs)
-        self._save()
+        values = dict(*args, **kwargs)
+        super().update(values)
+        self._persist(*(["set", key, value] for key, value in values.items()))
 
     def clear(self):
         super().clear()
-        self._save()
+        self._persist(["clear"])
 
     def pop(self, key, default=None):
         value = super().pop(key, default)
-        self._save()
+        self._persist(["del", key])
         return value
 
     def popitem(self):
         item = super().popitem()
-        self._save()
+        self._persist(["del", item[0]])
         return item
 
 
@@ -253,8 +595,8 @@ class Users():
     """
     A class for managing the surplus/deficit points of each user.
     """
-    def __init__(self, filename):
-        self._users = _Users(filename)
+    def __init__(self, filename, storage=None, **options):
+        self._users = _Users(filename, storage, **options)
 
     def up_and_down(self, up, down):
         """
@@ -264,8 +606,9 @@ class Users():
             raise KeyError(f"Up user {up} wasnt found in Users")
         if down not in self._users:
             raise KeyError(f"Down user {down} wasnt found in Users")
-        self._users[up] += 1
-        self._users[down] -= 1
+        with self._users.batch():
+            self._users[up] += 1
+            self._users[down] -= 1
 
     def get_score(self, user):
         """
@@ -275,6 +618,36 @@ class Users():
             raise KeyError(f"user {user} wasnt found in Users")
         return self._users[user]
 
+    def batch(self):
+        """
+        Hold back persistence of score changes until the block exits.
+        """
+        return self._users.batch()
+
+    def changed(self):
+        """
+        Whether another process changed the stored scores, see _Persisted.changed.
+        """
+        return self._users.changed()
+
+    def refresh(self):
+        """
+        Reload the scores if another process changed them, see _Persisted.refresh.
+        """
+        return self._users.refresh()
+
+    def set_scores(self, scores):
+        """
+        Overwrite the scores of the given users (a mapping of user to score).
+        """
+        self._users.update(scores)
+
+    def remove_user(self, user):
+        """
+        Remove a user and their score.
+        """
+        del self._users[user]
+
     def initiate_user(self, user):
         """
         Add a user to the dictionary and set their score to zero.
@@ -0,0 +1,568 @@
+"""
+The app's state and the rules for assigning and completing tasks, without any UI.
+"""
+import bisect
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timedelta
+import os
+
+from . import data, store, config, history, storage
+
+WRITE_DIR_ANDROID = "/sdcard/"
+ROOMS_FILENAME = "rooms.json"
+IT_FILENAME = "it.json"
+TASKS_FILENAME = "tasks.yaml"
+SCHEMA_FILENAME = "schema.json"
+USERS_FILENAME = "users.json"
+STATE_DB_FILENAME = "cleany.db"
+LOCK_FILENAME = "cleany.lock"
+
+
+def get_filepath(filename, directory=None):
+    """
+    Where a data file lives: in ``directory`` if given, otherwise the shared
+    storage on Android, or the working directory elsewhere.
+    """
+    if directory is not None:
+        return os.path.join(directory, filename)
+    if os.path.exists(WRITE_DIR_ANDROID):
+        return os.path.join(WRITE_DIR_ANDROID, filename)
+    return filename
+
+
+def load_config(directory=None):
+    """
+    Return the parsed and validated tasks.yaml (from ``directory`` if given).
+    """
+    return config.load(get_filepath(TASKS_FILENAME, directory), SCHEMA_FILENAME)
+
+
+def task_users(room_dict, task_dict):
+    """
+    The users a task rotates between: its own if it overrides the room's.
+    """
+    if isinstance(task_dict, dict) and "users" in task_dict:
+        return task_dict["users"]
+    return room_dict["users"]
+
+
+def configured_users(data_dict):
+    """
+    Everyone in tasks.yaml: its top-level ``users`` if given, otherwise
+    everyone its rooms, tasks and indefinite tasks rotate between, in order.
+    """
+    if "users" in data_dict:
+        return data_dict["users"]
+    users = {}
+    for room in data_dict["rooms"].values():
+        users.update(dict.fromkeys(room["users"]))
+        for task in room["tasks"].values():
+            users.update(dict.fromkeys(task_users(room, task)))
+    for task in data_dict["indefinite_tasks"].values():
+        users.update(dict.fromkeys(task["users"]))
+    return list(users)
+
+
+def _deal(load, users):
+    # The user of a rotation with the fewest tasks (the first of them on a tie),
+    # counting the task dealt to them in ``load``
+    user = min(users, key=lambda name: load[name])
+    load[user] += 1
+    return user
+
+
+def _task_period(task_dict):
+    if isinstance(task_dict, str):
+        return task_dict
+    return task_dict["period"]
+
+
+def parse_period(period):
+    """
+    Parse a period like "3d", "2w" or "1m" (30 days) into a timedelta.
+    """
+    unit = period[-1]
+    value = int(period[:-1])
+    if unit == 'd':
+        return timedelta(days=value)
+    if unit == 'w':
+        return timedelta(weeks=value)
+    if unit == 'm':
+        return timedelta(days=value * 30)
+    return timedelta(days=1)
+
+
+def next_user(users, current_user):
+    """
+    The user after ``current_user`` in the rotation.
+    """
+    return users[(users.index(current_user) + 1) % len(users)]
+
+
+class Engine:
+    """
+    Loads the assigned tasks, indefinite tasks and users' scores, brings them in
+    line with tasks.yaml, and applies task completions to them.
+
+    :param data: The parsed tasks.yaml, loaded from disk when not given
+    :param persister: A storage.Persister writing the state files in the background,
+        they are written synchronously when not given
+    :param now: Returns the current datetime, replaced to simulate the passing of time
+    :param directory: Where tasks.yaml and the state files are, see get_filepath()
+
+    Several processes can share the state files: changes are made holding the
+    directory's storage.StateLock, after reloading whatever another process
+    changed since (see locked()).
+    """
+
+    # pylint: disable=too-many-instance-attributes
+    # pylint: disable-next=redefined-outer-name
+    def __init__(self, data=None, persister=None, now=datetime.now, directory=None):
+        self.directory = directory
+        self.data = data if data is not None else load_config(directory)
+        self.persister = persister
+        self.now = now
+        self.lock = storage.state_lock(self._path(LOCK_FILENAME))
+        self.history = None
+        # Loading holds the lock, with nothing to reload yet, see locked()
+        self._lock_depth = 1
+        with self.lock:
+            self._open_history()
+            self._open_store()
+            self._initiate_users()
+            self._initiate_tasks()
+        self._lock_depth = 0
+        self.reconcile() # In case tasks.yaml was edited since the last run
+
+    def close(self):
+        """
+        Release the state store. Pending background writes are up to the persister.
+        """
+        if self.history is not None:
+            self.history.close()
+        if self.store:
+            self.store.close()
+
+    def reload(self, new_data):
+        """
+        Switch to a new version of tasks.yaml.
+        """
+        self.data = new_data
+        self._open_history()
+        self.reconcile()
+
+    def _open_history(self):
+        # Completions are logged with 'history: true', see history.History
+        if self.data.get('history') and self.history is None:
+            self.history = history.History(self._path(history.HISTORY_FILENAME),
+                                           self.persister, self.lock)
+        elif not self.data.get('history') and self.history is not None:
+            self.history.close()
+            self.history = None
+
+    def reconcile(self):
+        """
+        Bring the existing state in line with tasks.yaml, persisting it all at once.
+        """
+        with self.transaction(self.assigned_tasks, self.indefinite_tasks, self.users):
+            self._reconcile_users()
+            self._reconcile_tasks()
+            self._reconcile_indefinite_tasks()
+
+    def _reconcile_users(self):
+        users = configured_users(self.data)
+        known = [user for user, _ in self.users.all()]
+        for user in known:
+            if user not in users:
+                self.users.remove_user(user)
+        for user in users:
+            if user not in known:
+                self.users.initiate_user(user)
+
+    def _reconcile_tasks(self):
+        rooms = self.data['rooms']
+        load = Counter(task.user for task in self.assigned_tasks.values())
+
+        # Drop deleted tasks, re-time tasks whose period changed and
+        # deal out tasks of removed users to the remaining ones
+        for task in list(self.assigned_tasks.values()):
+            room = rooms.get(task.room)
+            task_obj = room['tasks'].get(task.name) if room else None
+            if task_obj is None:
+                self.assigned_tasks.remove(task)
+                continue
+            users = task_users(room, task_obj)
+            user = task.user if task.user in users else _deal(load, users)
+            period_str = _task_period(task_obj)
+            if user != task.user or period_str != task.period:
+                due_date = (task.due_date - parse_period(task.period)
+                            + parse_period(period_str))
+                self.assigned_tasks.add(
+                    data.new_task(user, task.room, task.name, due_date, period_str))
+
+        # Deal out new tasks too
+        for room_name, room in rooms.items():
+            for task_name, task_obj in room['tasks'].items():
+                if (room_name, task_name) not in self.assigned_tasks:
+                    self.assign_task(room_name, task_name,
+                                     _deal(load, task_users(room, task_obj)), True, False)
+
+    def _reconcile_indefinite_tasks(self):
+        details = self.data['indefinite_tasks']
+        for i in reversed(range(len(self.indefinite_tasks))):
+            task = self.indefinite_tasks[i]
+            if task.name not in details:
+                self.indefinite_tasks.pop(i)
+                continue
+            users = details[task.name]['users']
+            reps = details[task.name]['repetitions']
+            if task.user not in users:
+                self.indefinite_tasks[i] = data.new_indefinite_task(users[0], task.name, reps)
+            elif task.total_reps != reps:
+                new_task = data.new_indefinite_task(task.user, task.name, reps)
+                new_task.rep = min(task.rep, reps)
+                self.indefinite_tasks[i] = new_task
+
+        names = {task.name for task in self.indefinite_tasks}
+        for name, task in details.items():
+            if name not in names:
+                bisect.insort(self.indefinite_tasks,
+                              data.new_indefinite_task(task['users'][0], name,
+                                                       task['repetitions']))
+
+    def _collections(self):
+        return (self.assigned_tasks, self.indefinite_tasks, self.users)
+
+    def changed(self):
+        """
+        Whether another process changed the state since it was last read or written.
+        Costs a stat per state file, or a query with sqlite storage.
+        """
+        return (any(collection.changed() for collection in self._collections())
+                or (self.history is not None and self.history.changed()))
+
+    def refresh(self):
+        """
+        Reload whatever another process changed in the state. Returns whether
+        anything was reloaded.
+        """
+        if self._lock_depth:
+            return False # Already up to date, see locked()
+        with self.lock:
+            return self._reload_changed()
+
+    def _reload_changed(self):
+        reloaded = [collection.refresh() for collection in self._collections()]
+        if self.history is not None:
+            reloaded.append(self.history.refresh())
+        return any(reloaded)
+
+    @contextmanager
+    def locked(self):
+        """
+        Hold the state lock for the block, after reloading whatever another process
+        changed. Nests; only the outermost block takes the lock and reloads.
+        """
+        if self._lock_depth == 0:
+            self.lock.acquire()
+            try:
+                self._reload_changed()
+            except BaseException:
+                self.lock.release()
+                raise
+        self._lock_depth += 1
+        try:
+            yield self
+        finally:
+            self._lock_depth -= 1
+            if self._lock_depth == 0:
+                self.lock.release()
+
+    def _path(self, filename):
+        return get_filepath(filename, self.directory)
+
+    def _storage_options(self):
+        return {"journal": self.data.get('storage', 'json') == 'journal',
+                "state_format": self.data.get('state_format', 'json'),
+                "persister": self.persister, "lock": self.lock}
+
+    def _open_store(self):
+        # With sqlite storage, all state lives in one database instead of the JSON files
+        self.store = None
+        if self.data.get('storage') == 'sqlite':
+            self.store = store.SqliteStore(self._path(STATE_DB_FILENAME))
+            self.store.migrate(self._path(ROOMS_FILENAME), self._path(IT_FILENAME),
+                               self._path(USERS_FILENAME))
+
+    def transaction(self, *collections):
+        """
+        Changes to the given collections are persisted once, when the block exits,
+        and with sqlite storage all within a single database transaction. The
+        block holds the state lock, see locked().
+        """
+        stack = ExitStack()
+        stack.enter_context(self.locked())
+        if self.store:
+            stack.enter_context(self.store.transaction())
+        for collection in collections:
+            stack.enter_context(collection.batch())
+        return stack
+
+    def _get_new_user(self, room_dict, task_dict, current_user):
+        return next_user(task_users(room_dict, task_dict), current_user)
+
+    def _get_new_duedate(self, task_dict, init):
+        # true if the yaml contents of the task is just the period
+        is_simple = isinstance(task_dict, str)
+        # Find the new due date
+        if is_simple:
+            period_str = task_dict
+            period = parse_period(period_str)
+        else:
+            period_str = task_dict["period"]
+            period = parse_period(period_str)
+            if "stagger" in task_dict and init:
+                stagger = parse_period(task_dict["stagger"])
+                period = period + stagger
+        return period_str, (self.now() + period).date()
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    # Ehh
+    def assign_task(self, room_name, task_name, current_user, init, advance_user):
+        """
+        (Re)assign a task, to the user after ``current_user`` when ``advance_user``.
+        Returns the user it was assigned to.
+        """
+
+        # Get data that was loaded from the yaml file
+        room = self.data['rooms'][room_name]
+        task_obj = room['tasks'][task_name]
+
+        # Find the new user
+        if advance_user:
+            new_user = self._get_new_user(room, task_obj, current_user)
+        else:
+            new_user = current_user
+
+        # Find the new due date and the period string
+        period_str, due_date = self._get_new_duedate(task_obj, init)
+
+        new_task = data.new_task(new_user, room_name, task_name, due_date, period_str)
+        self.assigned_tasks.add(new_task)
+        if init:
+            # Logged so that rebuilding from the history finds the same due date
+            self._record("assign", room_name, task_name, new_user, new_user,
+                         next_user=new_user, next_due=new_task.due_date.toordinal(),
+                         period=period_str)
+        return new_user
+
+
+    def _initiate_users(self):
+
+        # Get file paths
+        user_path = self._path(USERS_FILENAME)
+
+        # Initate users
+        if self.store:
+            self.users = self.store.users()
+        else:
+            self.users = data.Users(user_path, **self._storage_options())
+        if self.users.size() == 0:
+            # Start from the scores in the history, if there is one
+            scores = self.history.scores() if self.history is not None else {}
+            users = configured_users(self.data)
+            with self.transaction(self.users):
+                for user in users:
+                    self.users.initiate_user(user)
+                self.users.set_scores({user: scores[user] for user in users if user in scores})
+
+    def _initiate_tasks(self):
+
+        # Get file paths
+        rooms_path = self._path(ROOMS_FILENAME)
+        it_path = self._path(IT_FILENAME)
+
+        # Initate Assigned Tasks
+        if self.store:
+            self.assigned_tasks = self.store.schedule()
+        else:
+            self.assigned_tasks = data.Schedule(rooms_path, **self._storage_options())
+        if len(self.assigned_tasks) == 0:
+            with self.transaction(self.assigned_tasks):
+                if not self._restore_tasks():
+                    self._seed_tasks()
+
+        # Initiate Indefinite tasks
+        if self.store:
+            self.indefinite_tasks = self.store.indefinite_tasks()
+        else:
+            self.indefinite_tasks = data.IndefiniteTasks(it_path, **self._storage_options())
+        if len(self.indefinite_tasks) == 0:
+            restored = {task: (user, rep) for task, user, rep
+                        in (self.history.indefinite_tasks() if self.history is not None else [])}
+            with self.transaction(self.indefinite_tasks):
+                for task, details in self.data['indefinite_tasks'].items():
+                    user0, rep = restored.get(task, (details['users'][0], 1))
+                    reps = details['repetitions']
+                    new_task = data.new_indefinite_task(user0, task, reps)
+                    new_task.rep = min(rep, reps)
+                    bisect.insort(self.indefinite_tasks, new_task)
+
+    def _restore_tasks(self):
+        # Rebuild the schedule from the history, where each task is logged from its
+        # first assignment on; reconcile() fills in what is missing
+        if self.history is None:
+            return False
+        rooms = self.data['rooms']
+        for room, task, user, due_date, period in self.history.tasks():
+            if task in rooms.get(room, {}).get('tasks', {}):
+                self.assigned_tasks.add(data.new_task(user, room, task, due_date, period))
+        return len(self.assigned_tasks) > 0
+
+    def _seed_tasks(self):
+        for room, details in self.data['rooms'].items():
+            # find last user because _assign_tasks assigns to the next user, and we want
+            # to start on the first user
+            user = details['users'][-1]
+            for task_name, task in details['tasks'].items():
+                if isinstance(task, str) or "users" not in task:
+                    user = self.assign_task(room, task_name, user, True, True)
+                else:
+                    # if the task overrides the user section, ignore the rolling user assignment
+                    # and just assign the first user
+                    self.assign_task(room, task_name, task["users"][0], True, True)
+
+    def find_users_for_task(self, task, indefinite):
+        """
+        Return the list of users a task rotates between.
+        """
+        if indefinite:
+            return self.data['indefinite_tasks'][task.name]['users']
+
+        room = self.data['rooms'][task.room]
+        if not room:
+            return []  # Room not found
+
+        task = room['tasks'][task.name]
+        if not task:
+            return []  # Task not found
+
+        # If users are specified for the task, use those
+        if isinstance(task, dict) and "users" in task:
+            return task["users"]
+
+        # Otherwise, fall back to the users assigned to the room
+        return room["users"]
+
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def _record(self, kind, room, task, user, credited, **result):
+        if self.history is not None:
+            self.history.record(kind, self.now().timestamp(), room, task, user, credited,
+                                **result)
+
+    def _record_task(self, task, credited):
+        new_task = self.assigned_tasks[(task.room, task.name)]
+        self._record("task", task.room, task.name, task.user, credited,
+                     due=task.due_date.toordinal(), next_user=new_task.user,
+                     next_due=new_task.due_date.toordinal(), period=new_task.period)
+
+    def _current(self, task, indefinite=False):
+        # The task as it is now, in case tasks.yaml or another process changed it
+        # since it was shown, or None if it is gone
+        if indefinite:
+            return self.indefinite_tasks.find(task.name)
+        return self.assigned_tasks.get((task.room, task.name))
+
+    def _reschedule(self, task, advance_user):
+        with self.transaction(self.assigned_tasks):
+            self.assigned_tasks.remove(task)
+            self.assign_task(task.room, task.name, task.user, False, advance_user)
+
+    def complete_task(self, task, advance_user=True):
+        """
+        Mark an assigned task done, rescheduling it for its next period.
+        """
+        with self.locked():
+            current = self._current(task)
+            if current is None:
+                raise KeyError(f"Task {task.name} wasnt found")
+            task = current
+            self._reschedule(task, advance_user)
+            self._record_task(task, task.user)
+
+    def surplus_and_deficit(self, up, down):
+        """
+        Move a point from ``down`` to ``up``.
+        """
+        with self.locked():
+            with self.transaction(self.users):
+                self.users.up_and_down(up, down)
+            self._record("score", None, None, down, up)
+
+    def complete_task_as(self, task, user, indefinite):
+        """
+        Record that ``user`` did a task in place of its assignee, who owes them a point.
+        The task and the scores are updated together, or not at all.
+        """
+        with self.locked():
+            current = self._current(task, indefinite)
+            if current is None:
+                raise KeyError(f"Task {task.name} wasnt found")
+            task = current
+            # Raise KeyError for unknown users before changing anything
+            self.users.get_score(user)
+            self.users.get_score(task.user)
+            with self.transaction(self.assigned_tasks, self.users):
+                if not indefinite:
+                    self._reschedule(task, advance_user=False)
+                self.users.up_and_down(user, task.user)
+            if indefinite:
+                self._record("indefinite", None, task.name, task.user, user,
+                             next_user=task.user, rep=task.rep)
+            else:
+                self._record_task(task, user)
+
+    def complete_indefinite_task(self, task_name):
+        """
+        Count a repetition of an indefinite task, moving on to the next user once
+        all repetitions are done. Returns the updated task.
+        """
+        with self.locked():
+            with self.transaction(self.indefinite_tasks):
+                i, task = self.indefinite_tasks.increment(task_name)
+                user = task.user
+
+                # If user has finished the required number of repetitions, reset reps back
+                # to 1 and go to the next user
+                if task.rep > task.total_reps:
+                    users = self.data['indefinite_tasks'][task.name]['users']
+                    self.indefinite_tasks.reset(i, next_user(users, task.user))
+            self._record("indefinite", None, task.name, user, user,
+                         next_user=task.user, rep=task.rep)
+        return task
+
+    def complete(self, room, task_name, user=None):
+        """
+        Complete a task by name: an assigned task in ``room``, or the indefinite
+        task ``task_name`` when ``room`` is None. If ``user`` is given and is not
+        the assignee, it is completed on their behalf (see complete_task_as).
+        Returns the task as it is after completion.
+        """
+        indefinite = room is None
+        with self.locked():
+            if indefinite:
+                task = self.indefinite_tasks.find(task_name)
+            else:
+                task = self.assigned_tasks.get((room, task_name))
+            if task is None:
+                raise KeyError(f"Task {task_name} wasnt found")
+            if user is not None and user != task.user:
+                if user not in self.find_users_for_task(task, indefinite):
+                    raise ValueError(f"{user} does not do {task_name}")
+                self.complete_task_as(task, user, indefinite)
+            elif indefinite:
+                self.complete_indefinite_task(task_name)
+            else:
+                self.complete_task(task)
+            return task if indefinite else self.assigned_tasks[(room, task_name)]
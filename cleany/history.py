@@ -0,0 +1,267 @@
+"""
+An append-only log of task completions and score changes, for auditing who did
+what, and for rebuilding the state from.
+"""
+
+from array import array
+from datetime import date
+import json
+import os
+
+from .storage import write_file
+
+HISTORY_FILENAME = "history.jsonl"
+SNAPSHOT_SUFFIX = ".snapshot"
+SNAPSHOT_EVERY = 500
+_SNAPSHOT_VERSION = 3
+# The per-name indexes, in the order the snapshot stores them
+_INDEXES = ("users", "rooms", "tasks")
+
+
+def _task_key(room, task):
+    return f"{room}/{task}" if room is not None else task
+
+
+class History:
+    """
+    Completion events, one JSON object per line of ``filename``:
+
+    ``at``: unix time, ``kind``: "task", "indefinite", "score" or "assign" (a task
+    assigned for the first time, not completed), ``room`` (None for indefinite
+    tasks), ``task``, ``user`` (the assignee, or the user losing a point),
+    ``credited`` (who did it, or the user gaining a point), ``due`` (the due date,
+    as an ordinal) and the resulting state of the task: ``next_user`` and
+    ``next_due`` or ``rep``, and ``period``.
+
+    The byte offset of each event is indexed per user, room and task, so queries read
+    only the matching lines. The indexes, and the state the log adds up to (each
+    task's assignee, indefinite tasks' repetitions, and scores), are snapshotted
+    every SNAPSHOT_EVERY events; on load only the events after the snapshot are read.
+    The snapshot is a JSON header line followed by the raw bytes of the indexes.
+
+    Writes hold ``lock`` (a storage.StateLock), if given, and refresh() picks up
+    the events other processes appended since.
+
+    ``listeners`` are called with each event logged or picked up from then on, and
+    the size of the log up to its end.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, filename, persister=None, lock=None):
+        self.filename = filename
+        self.snapshot_filename = filename + SNAPSHOT_SUFFIX
+        self.persister = persister
+        self.lock = lock
+        self._offsets = array("Q")
+        self._users = {}
+        self._rooms = {}
+        self._tasks = {}
+        self._state = {"tasks": {}, "indefinite": {}, "scores": {}}
+        self._size = 0
+        self._since_snapshot = 0
+        self.listeners = []
+        self._load()
+
+    def _load(self):
+        snapshot = self._read_snapshot()
+        if snapshot:
+            header, indexes = snapshot
+            self._size = header["size"]
+            self._state = header["state"]
+            self._offsets = indexes.pop(0)
+            for name in _INDEXES:
+                index = getattr(self, "_" + name)
+                for (key, _), offsets in zip(header[name], indexes):
+                    index[key] = offsets
+                del indexes[:len(header[name])]
+        self._read_tail()
+
+    def _read_tail(self):
+        try:
+            with open(self.filename, "rb") as file:
+                file.seek(self._size)
+                for line in file:
+                    if not line.endswith(b"\n"):
+                        break # Torn write at the tail of the log
+                    self._add(json.loads(line), len(line))
+        except FileNotFoundError:
+            pass
+
+    def changed(self):
+        """
+        Whether other processes appended events since they were last read.
+        """
+        try:
+            return os.path.getsize(self.filename) > self._size
+        except OSError:
+            return False
+
+    def refresh(self):
+        """
+        Read the events appended by other processes since. Returns whether there were any.
+        """
+        if not self.changed():
+            return False
+        count = len(self._offsets)
+        self._read_tail()
+        return len(self._offsets) > count
+
+    def _read_snapshot(self):
+        # Return the snapshot's header, and its indexes: all offsets, then those
+        # of each user, room and task in the header's order
+        try:
+            with open(self.snapshot_filename, "rb") as file:
+                raw = file.read()
+            start = raw.index(b"\n") + 1
+            header = json.loads(raw[:start])
+            # Ignore a snapshot in another layout, or of a log that has since been
+            # replaced or truncated
+            if (header.get("version") != _SNAPSHOT_VERSION
+                    or os.path.getsize(self.filename) < header["size"]):
+                return None
+            indexes = []
+            counts = [header["offsets"]] + [n for name in _INDEXES for _, n in header[name]]
+            for count in counts:
+                end = start + count * self._offsets.itemsize
+                indexes.append(array("Q", raw[start:end]))
+                start = end
+            if start != len(raw):
+                return None # Torn write
+            return header, indexes
+        except (OSError, ValueError, KeyError, AttributeError):
+            return None
+
+    def _add(self, event, length):
+        # Index an event at the end of the log, and pass it on
+        self._index(event, self._size)
+        self._size += length
+        self._since_snapshot += 1
+        for listener in self.listeners:
+            listener(event, self._size)
+
+    def _index(self, event, offset):
+        self._offsets.append(offset)
+        users = (event["user"], event["credited"])
+        for user in users[:1] if users[0] == users[1] else users:
+            self._users.setdefault(user, array("Q")).append(offset)
+        if event["room"] is not None:
+            self._rooms.setdefault(event["room"], array("Q")).append(offset)
+        if event["kind"] != "score":
+            self._tasks.setdefault(_task_key(event["room"], event["task"]),
+                                   array("Q")).append(offset)
+        self._apply(event)
+
+    def _apply(self, event):
+        # Fold an event into the state the log adds up to
+        scores = self._state["scores"]
+        if event["credited"] != event["user"]:
+            scores[event["credited"]] = scores.get(event["credited"], 0) + 1
+            scores[event["user"]] = scores.get(event["user"], 0) - 1
+        if event["kind"] in ("task", "assign"):
+            self._state["tasks"][_task_key(event["room"], event["task"])] = [
+                event["room"], event["task"], event["next_user"], event["next_due"],
+                event["period"]]
+        elif event["kind"] == "indefinite":
+            self._state["indefinite"][event["task"]] = [event["next_user"], event["rep"]]
+
+    def _write(self, filename, raw, append=False):
+        if self.persister:
+            self.persister.write(filename, raw, append, self.lock)
+        elif self.lock:
+            with self.lock:
+                write_file(filename, raw, append)
+        else:
+            write_file(filename, raw, append)
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def record(self, kind, at, room, task, user, credited, **result):
+        """
+        Append an event. ``result`` holds the task's resulting state
+        (next_user and next_due or rep, and period), see the class docstring.
+        """
+        event = {"at": at, "kind": kind, "room": room, "task": task,
+                 "user": user, "credited": credited, **result}
+        raw = (json.dumps(event) + "\n").encode("utf-8")
+        self._write(self.filename, raw, append=True)
+        self._add(event, len(raw))
+        if self._since_snapshot >= SNAPSHOT_EVERY:
+            self.snapshot()
+
+    def snapshot(self):
+        """
+        Write the indexes and the state out, so loading can skip the events so far.
+        """
+        header = {"version": _SNAPSHOT_VERSION, "size": self._size, "state": self._state,
+                  "offsets": len(self._offsets)}
+        indexes = [self._offsets]
+        for name in _INDEXES:
+            index = getattr(self, "_" + name)
+            header[name] = [[key, len(offsets)] for key, offsets in index.items()]
+            indexes.extend(index.values())
+        self._write(self.snapshot_filename,
+                    b"".join([json.dumps(header).encode("utf-8") + b"\n"]
+                             + [offsets.tobytes() for offsets in indexes]))
+        self._since_snapshot = 0
+
+    def close(self):
+        """
+        Snapshot, if SNAPSHOT_EVERY events were read or logged since the last one
+        (as by other processes, which snapshot only on that cadence too).
+        """
+        if self._since_snapshot >= SNAPSHOT_EVERY:
+            self.snapshot()
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def events(self, user=None, room=None, task=None, limit=None):
+        """
+        Return the events involving ``user`` and/or of a ``task`` (in ``room``, or an
+        indefinite task without) or of any task in ``room``, newest first, reading
+        only the matching events.
+        """
+        filters = []
+        if user is not None:
+            filters.append(self._users.get(user, array("Q")))
+        if task is not None:
+            filters.append(self._tasks.get(_task_key(room, task), array("Q")))
+        elif room is not None:
+            filters.append(self._rooms.get(room, array("Q")))
+        # Walk the shortest of the matching offsets, keeping those in the others
+        filters.sort(key=len)
+        offsets = filters[0] if filters else self._offsets
+        for other in filters[1:]:
+            other = set(other)
+            offsets = [offset for offset in offsets if offset in other]
+        if not offsets:
+            return []
+        if self.persister:
+            self.persister.flush()
+        found = []
+        with open(self.filename, "rb") as file:
+            for offset in reversed(offsets):
+                if limit is not None and len(found) >= limit:
+                    break
+                file.seek(offset)
+                found.append(json.loads(file.readline()))
+        return found
+
+    def scores(self):
+        """
+        The scores the log adds up to, by user.
+        """
+        return dict(self._state["scores"])
+
+    def tasks(self):
+        """
+        Each completed task's state after its last completion, as
+        (room, task, user, due_date, period) tuples.
+        """
+        return [(room, task, user, date.fromordinal(due), period)
+                for room, task, user, due, period in self._state["tasks"].values()]
+
+    def indefinite_tasks(self):
+        """
+        Each completed indefinite task's (task, user, rep) after its last completion.
+        """
+        return [(task, user, rep) for task, (user, rep) in self._state["indefinite"].items()]
@@ -0,0 +1,114 @@
+"""
+Low-power mode for running on a wall-mounted display around the clock.
+"""
+
+import logging
+import time
+
+IDLE_TIMEOUT = 120
+IDLE_FPS = 2
+
+_log = logging.getLogger(__name__)
+
+
+class Kiosk:
+    """
+    Throttles the app while nobody is using it.
+
+    Kivy only redraws when something on screen changed, but its main loop still
+    wakes up ``maxfps`` times a second to poll for input. Once no touch arrived
+    for ``idle_timeout`` seconds, the loop is slowed down to ``idle_fps`` and
+    ``on_idle`` is called to pause non-essential work. The next touch (picked up
+    within one idle frame) restores the full frame rate and calls ``on_active``.
+
+    stats() reports the CPU time used and the main loop wakeups and redraws,
+    per mode, so the savings can be checked.
+
+    :param clock: The kivy clock
+    :param window: The kivy window
+    """
+
+    # pylint: disable=too-many-instance-attributes,too-many-arguments,too-many-positional-arguments
+    def __init__(self, clock, window, idle_timeout=IDLE_TIMEOUT, idle_fps=IDLE_FPS,
+                 on_idle=None, on_active=None):
+        self.clock = clock
+        self.window = window
+        self.idle_timeout = idle_timeout
+        self.idle_fps = idle_fps
+        self.on_idle = on_idle
+        self.on_active = on_active
+        self.idle = False
+        self._active_fps = None
+        self._last_touch = time.monotonic()
+        self._event = None
+        self._since = self._sample()
+        self._totals = {mode: {"seconds": 0.0, "cpu_time": 0.0, "wakeups": 0, "redraws": 0}
+                        for mode in ("active", "idle")}
+
+    def start(self):
+        """
+        Start watching for input.
+        """
+        self._active_fps = self.clock._max_fps # pylint: disable=protected-access
+        self.window.bind(on_motion=self._on_motion)
+        self._arm(self.idle_timeout)
+
+    def stop(self):
+        """
+        Stop watching for input and restore the full frame rate.
+        """
+        self.window.unbind(on_motion=self._on_motion)
+        if self._event:
+            self._event.cancel()
+            self._event = None
+        if self.idle:
+            self._set_idle(False)
+
+    def _arm(self, timeout):
+        self._event = self.clock.schedule_once(self._check_idle, timeout)
+
+    def _check_idle(self, _):
+        # Touches only record their time, the timeout is checked here once it may be up
+        remaining = self._last_touch + self.idle_timeout - time.monotonic()
+        if remaining > 0:
+            self._arm(remaining)
+        else:
+            self._event = None
+            self._set_idle(True)
+
+    def _on_motion(self, _window, _etype, _motion):
+        self._last_touch = time.monotonic()
+        if self.idle:
+            self._set_idle(False)
+            self._arm(self.idle_timeout)
+
+    def _sample(self):
+        return (time.monotonic(), time.process_time(),
+                self.clock.frames, self.clock.frames_displayed)
+
+    def _account(self):
+        now = self._sample()
+        totals = self._totals["idle" if self.idle else "active"]
+        for key, start, end in zip(("seconds", "cpu_time", "wakeups", "redraws"),
+                                   self._since, now):
+            totals[key] += end - start
+        self._since = now
+
+    def _set_idle(self, idle):
+        self._account()
+        self.idle = idle
+        # pylint: disable=protected-access
+        self.clock._max_fps = self.idle_fps if idle else self._active_fps
+        callback = self.on_idle if idle else self.on_active
+        if callback:
+            callback()
+        _log.info("Kiosk: %s, %s", "idle" if idle else "active", self.stats())
+
+    def stats(self):
+        """
+        Return the current mode, and the seconds spent, CPU time used, main loop
+        wakeups and redraws in each mode.
+        """
+        self._account()
+        return {"mode": "idle" if self.idle else "active",
+                **{mode: dict(totals) for mode, totals in self._totals.items()}}
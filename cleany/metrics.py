@@ -0,0 +1,220 @@
+"""
+Opt-in timing of the app's hot paths.
+
+Functions decorated with timed(), and blocks run under timer(), record how long
+they took, and count() bumps counters. While disabled (the default) these cost
+one flag check. Once enabled, each timing goes into a rolling window of the most
+recent samples per name, which is written to a metrics file every
+``flush_interval`` seconds, so it survives restarts and can be read by another
+process (see ``main.py stats``).
+"""
+
+from collections import deque
+from contextlib import contextmanager
+import functools
+import json
+import logging
+import threading
+import time
+
+METRICS_FILENAME = "metrics.json"
+WINDOW = 1024
+FLUSH_INTERVAL = 60
+
+_log = logging.getLogger(__name__)
+
+
+class _Series: # pylint: disable=too-few-public-methods
+    """
+    The most recent WINDOW timings of one hot path, and running totals.
+    """
+    def __init__(self, samples=(), calls=0, total=0.0):
+        self.samples = deque(samples, maxlen=WINDOW)
+        self.count = calls
+        self.total = total
+
+    def add(self, seconds):
+        """
+        Record one timing.
+        """
+        self.samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+
+
+class _Registry: # pylint: disable=too-few-public-methods
+    """
+    Everything recorded so far, and whether recording is on.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.series = {}
+        self.counters = {}
+        self.flusher = None
+
+
+_registry = _Registry()
+
+
+def percentile(samples, fraction):
+    """
+    Return the value below which ``fraction`` of the samples fall, or None without any.
+    """
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def record(name, seconds):
+    """
+    Record a timing, if enabled.
+    """
+    if not _registry.enabled:
+        return
+    with _registry.lock:
+        series = _registry.series.get(name)
+        if series is None:
+            series = _registry.series[name] = _Series()
+        series.add(seconds)
+
+
+def count(name, amount=1):
+    """
+    Bump a counter, if enabled.
+    """
+    if not _registry.enabled:
+        return
+    with _registry.lock:
+        _registry.counters[name] = _registry.counters.get(name, 0) + amount
+
+
+@contextmanager
+def timer(name):
+    """
+    Time the block, if enabled.
+    """
+    if not _registry.enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def timed(name):
+    """
+    Decorator timing every call of a function, if enabled.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _registry.enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def snapshot():
+    """
+    Return the recorded timings and counters, in the metrics file's layout.
+    """
+    with _registry.lock:
+        return {"timings": {name: {"count": series.count, "total_s": series.total,
+                                   "samples": list(series.samples)}
+                            for name, series in _registry.series.items()},
+                "counters": dict(_registry.counters)}
+
+
+def load(filename):
+    """
+    Return the contents of a metrics file, or None if there is none.
+    """
+    try:
+        with open(filename, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def summary(doc):
+    """
+    Return (name, count, p50, p95, max) of each timing in a metrics snapshot,
+    slowest p95 first.
+    """
+    rows = []
+    for name, timing in doc.get("timings", {}).items():
+        samples = timing["samples"]
+        rows.append((name, timing["count"], percentile(samples, 0.5),
+                     percentile(samples, 0.95), max(samples, default=None)))
+    return sorted(rows, key=lambda row: row[3] or 0, reverse=True)
+
+
+class _Flusher:
+    """
+    Writes the metrics to a file every ``interval`` seconds, from a background thread.
+    """
+    def __init__(self, filename, interval):
+        self.filename = filename
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="cleany-metrics", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.flush()
+
+    def flush(self):
+        """
+        Write the metrics out now.
+        """
+        try:
+            # Imported here, as storage imports this module (through serializers)
+            from .storage import write_file # pylint: disable=import-outside-toplevel,cyclic-import
+            write_file(self.filename, json.dumps(snapshot()).encode("utf-8"))
+        except OSError:
+            _log.exception("Metrics: failed to write %s", self.filename)
+
+    def stop(self):
+        """
+        Stop the thread, writing the metrics out one last time.
+        """
+        self._stopped.set()
+        self._thread.join()
+        self.flush()
+
+
+def enable(filename, flush_interval=FLUSH_INTERVAL):
+    """
+    Start recording, continuing from the metrics already in ``filename``, and
+    write them back to it periodically.
+    """
+    if _registry.enabled:
+        return
+    previous = load(filename) or {}
+    with _registry.lock:
+        for name, timing in previous.get("timings", {}).items():
+            _registry.series[name] = _Series(timing["samples"], timing["count"],
+                                             timing["total_s"])
+        _registry.counters.update(previous.get("counters", {}))
+    _registry.enabled = True
+    _registry.flusher = _Flusher(filename, flush_interval)
+
+
+def disable():
+    """
+    Stop recording, writing out what was recorded.
+    """
+    _registry.enabled = False
+    if _registry.flusher:
+        _registry.flusher.stop()
+        _registry.flusher = None
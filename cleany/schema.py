@@ -2,23 +2,91 @@
 Schema Validation
 """
 
+import hashlib
+import importlib.util
+import os
+
 import yaml
 import fastjsonschema
 
+from . import metrics
+
+# Generated validators are kept here, next to the schema file
+CACHE_DIRNAME = "__schemacache__"
+
+# libyaml's loader is several times faster, when available
+_SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+_validators = {}
+
+
+def load_yaml(stream):
+    """Parse a YAML document like yaml.safe_load, using libyaml when available."""
+    return yaml.load(stream, Loader=_SafeLoader) # nosec: safe loader
+
+
 def _load_schema_file(filename):
     with open(filename, 'r', encoding='utf-8') as file:
-        return yaml.safe_load(file)
+        return load_yaml(file)
+
+
+def _import_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@metrics.timed("schema.compile")
+def _generate(schema_path, module_name, module_path):
+    code = fastjsonschema.compile_to_code(_load_schema_file(schema_path))
+    try:
+        os.makedirs(os.path.dirname(module_path), exist_ok=True)
+        tmp = module_path + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as file:
+            file.write(code)
+        os.replace(tmp, module_path)
+        return _import_module(module_name, module_path).validate
+    except OSError:
+        # Read-only location, just keep the validator in memory
+        namespace = {}
+        exec(compile(code, schema_path, "exec"), namespace) # pylint: disable=exec-used
+        return namespace["validate"]
+
+
+def get_validator(schema_path):
+    """
+    Return the validation function for a JSON schema file.
+
+    The validator is generated once per schema content (and fastjsonschema
+    version) and stored as an importable module in a cache directory next to
+    the schema, so later runs import it (from bytecode) instead of compiling it.
+    """
+    with open(schema_path, 'rb') as file:
+        digest = hashlib.sha256(file.read() + fastjsonschema.VERSION.encode()).hexdigest()[:16]
+    if digest not in _validators:
+        module_name = f"schema_{digest}"
+        module_path = os.path.join(os.path.dirname(schema_path), CACHE_DIRNAME,
+                                   module_name + ".py")
+        validator = None
+        if os.path.exists(module_path):
+            try:
+                validator = _import_module(module_name, module_path).validate
+            except (ImportError, SyntaxError, AttributeError):
+                pass # Damaged cache entry, generate it again
+        _validators[digest] = validator or _generate(schema_path, module_name, module_path)
+    return _validators[digest]
 
 
+@metrics.timed("schema.validate_yaml")
 def validate_yaml(yaml_data, schema_path):
     """Validate YAML data against a JSON schema file."""
-    schema = _load_schema_file(schema_path)
-    val = fastjsonschema.compile(schema)
+    val = get_validator(schema_path)
     val(yaml_data)
 
 
 def validate(doc_path, schema_path):
     """Validate YAML document file against a JSON schema file."""
     with open(doc_path, 'r', encoding='utf-8') as file:
-        doc = yaml.safe_load(file)
+        doc = load_yaml(file)
     validate_yaml(doc, schema_path)
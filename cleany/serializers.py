@@ -0,0 +1,249 @@
+"""
+Encodings of the persisted collections' snapshots.
+
+"json" is the stdlib's, "orjson" the same JSON written by orjson, "binary" a
+compact layout of our own (see _Binary) and "msgpack" MessagePack. The binary
+encodings are prefixed with a magic string, so a snapshot's encoding is told
+from its first bytes on load, whatever the configured one. JSON is read with
+orjson whenever it is installed.
+
+None of them can run code when reading a file, which matters as the state
+may live in storage shared with other apps.
+
+Encoding and decoding are timed, and the bytes counted, per encoding with
+metrics (see ``main.py stats``), to compare them on a device.
+"""
+
+import json
+import logging
+import struct
+
+from . import metrics
+
+try:
+    import orjson # pylint: disable=import-error
+except ImportError:
+    orjson = None # pylint: disable=invalid-name
+
+try:
+    import msgpack # pylint: disable=import-error
+except ImportError:
+    msgpack = None # pylint: disable=invalid-name
+
+_log = logging.getLogger(__name__)
+
+_warned = set()
+
+
+class Serializer:
+    """
+    An encoding of JSON-like documents. Subclasses define ``name``, the ``magic``
+    prefix of what they write (none for JSON), and how they encode and decode.
+    """
+    name = None
+    magic = b""
+    # The Python module it needs, None if it is not installed
+    module = json
+
+    def _dumps(self, doc, indent):
+        raise NotImplementedError
+
+    def _loads(self, raw):
+        raise NotImplementedError
+
+    def dumps(self, doc, indent=None):
+        """
+        Return the document encoded, magic prefix included. ``indent`` is a hint
+        for the text encodings.
+        """
+        with metrics.timer(f"serializer.{self.name}.dumps"):
+            raw = self.magic + self._dumps(doc, indent)
+        metrics.count(f"serializer.{self.name}.bytes_written", len(raw))
+        return raw
+
+    def loads(self, raw):
+        """
+        Return the document decoded from ``raw``, magic prefix included.
+        """
+        with metrics.timer(f"serializer.{self.name}.loads"):
+            doc = self._loads(raw[len(self.magic):])
+        metrics.count(f"serializer.{self.name}.bytes_read", len(raw))
+        return doc
+
+
+class _Json(Serializer):
+    name = "json"
+
+    def _dumps(self, doc, indent):
+        return json.dumps(doc, indent=indent).encode("utf-8")
+
+    def _loads(self, raw):
+        if orjson is not None:
+            return orjson.loads(raw) # pylint: disable=no-member
+        return json.loads(raw)
+
+
+class _Orjson(_Json):
+    name = "orjson"
+    module = orjson
+
+    def _dumps(self, doc, indent):
+        # pylint: disable=no-member
+        return orjson.dumps(doc, option=orjson.OPT_INDENT_2 if indent else 0)
+
+
+_COUNT = struct.Struct("<I")
+_INT = struct.Struct("<q")
+_FLOAT = struct.Struct("<d")
+_CONSTANTS = {b"N"[0]: None, b"T"[0]: True, b"F"[0]: False}
+# "binary" snapshots used to be written with marshal. They are not read anymore:
+# marshal is unsafe on files others may have written, and changes between Pythons
+_MARSHAL_MAGIC = b"\x00CLNY1"
+
+
+class _Binary(Serializer):
+    """
+    A table of the document's strings (a count, then each one's UTF-8 length and
+    bytes), followed by the document: a tag byte per value, then ``N``, ``T``,
+    ``F``: nothing (None, True, False), ``i``: a signed 64-bit int, ``d``: a
+    double, ``s``: the string's index in the table, ``l``: the item count and the
+    items, ``m``: the entry count and each key and value. All little-endian,
+    counts and indexes as unsigned 32-bit ints.
+
+    Each user, room and task name is stored once however often it appears.
+    """
+    name = "binary"
+    magic = b"\x00CLNY2"
+
+    def _dumps(self, doc, indent):
+        strings = {}
+        body = bytearray()
+        self._encode(doc, strings, body)
+        table = [_COUNT.pack(len(strings))]
+        for string in strings:
+            raw = string.encode("utf-8")
+            table.append(_COUNT.pack(len(raw)))
+            table.append(raw)
+        return b"".join(table) + body
+
+    def _encode(self, value, strings, out):
+        # bool before int, which it subclasses
+        if value is None or isinstance(value, bool):
+            out += b"N" if value is None else b"T" if value else b"F"
+        elif isinstance(value, str):
+            out += b"s"
+            out += _COUNT.pack(strings.setdefault(value, len(strings)))
+        elif isinstance(value, int):
+            out += b"i"
+            out += _INT.pack(value)
+        elif isinstance(value, float):
+            out += b"d"
+            out += _FLOAT.pack(value)
+        elif isinstance(value, (list, tuple)):
+            out += b"l"
+            out += _COUNT.pack(len(value))
+            for item in value:
+                self._encode(item, strings, out)
+        elif isinstance(value, dict):
+            out += b"m"
+            out += _COUNT.pack(len(value))
+            for key, item in value.items():
+                self._encode(key, strings, out)
+                self._encode(item, strings, out)
+        else:
+            raise TypeError(f"Can't encode {type(value).__name__}")
+
+    def _loads(self, raw):
+        try:
+            (count,), pos = _COUNT.unpack_from(raw), _COUNT.size
+            strings = []
+            for _ in range(count):
+                (length,), pos = _COUNT.unpack_from(raw, pos), pos + _COUNT.size
+                strings.append(raw[pos:pos + length].decode("utf-8"))
+                pos += length
+            doc, pos = self._decode(raw, pos, strings)
+        except (struct.error, IndexError, TypeError, RecursionError) as e:
+            raise ValueError(f"Corrupt binary snapshot: {e}") from e
+        if pos != len(raw):
+            raise ValueError("Corrupt binary snapshot: trailing bytes")
+        return doc
+
+    def _decode(self, raw, pos, strings):
+        # Return the value at pos, and where the next one starts
+        tag = raw[pos]
+        pos += 1
+        if tag in _CONSTANTS:
+            return _CONSTANTS[tag], pos
+        if tag == b"s"[0]:
+            return strings[_COUNT.unpack_from(raw, pos)[0]], pos + _COUNT.size
+        if tag == b"i"[0]:
+            return _INT.unpack_from(raw, pos)[0], pos + _INT.size
+        if tag == b"d"[0]:
+            return _FLOAT.unpack_from(raw, pos)[0], pos + _FLOAT.size
+        if tag not in b"lm":
+            raise ValueError(f"Corrupt binary snapshot: unknown tag {tag}")
+        (count,), pos = _COUNT.unpack_from(raw, pos), pos + _COUNT.size
+        if tag == b"l"[0]:
+            items = []
+            for _ in range(count):
+                item, pos = self._decode(raw, pos, strings)
+                items.append(item)
+            return items, pos
+        entries = {}
+        for _ in range(count):
+            key, pos = self._decode(raw, pos, strings)
+            entries[key], pos = self._decode(raw, pos, strings)
+        return entries, pos
+
+
+class _Msgpack(Serializer):
+    name = "msgpack"
+    magic = b"\x00CLNYM"
+    module = msgpack
+
+    def _dumps(self, doc, indent):
+        return msgpack.packb(doc) # pylint: disable=no-member
+
+    def _loads(self, raw):
+        return msgpack.unpackb(raw, strict_map_key=False) # pylint: disable=no-member
+
+
+SERIALIZERS = {serializer.name: serializer
+               for serializer in (_Json(), _Orjson(), _Binary(), _Msgpack())}
+
+
+def available():
+    """
+    Return the names of the encodings that can be written here.
+    """
+    return [name for name, serializer in SERIALIZERS.items() if serializer.module is not None]
+
+
+def get(name):
+    """
+    Return the serializer of an encoding, or the stdlib JSON one (logging why)
+    if the encoding's module is not installed.
+    """
+    serializer = SERIALIZERS[name]
+    if serializer.module is None:
+        if name not in _warned:
+            _log.warning("Serializer: %s is not installed, writing json instead", name)
+            _warned.add(name)
+        return SERIALIZERS["json"]
+    return serializer
+
+
+def detect(raw):
+    """
+    Return the serializer that wrote ``raw``, judging by its magic prefix.
+    """
+    if raw.startswith(_MARSHAL_MAGIC):
+        raise ValueError("State written in marshal's format, which is no longer read")
+    for serializer in SERIALIZERS.values():
+        if serializer.magic and raw.startswith(serializer.magic):
+            if serializer.module is None:
+                # Reading it as empty would seed the state over it
+                raise RuntimeError(f"State written as {serializer.name}, "
+                                   f"which is not installed")
+            return serializer
+    return SERIALIZERS["json"]
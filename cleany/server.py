@@ -0,0 +1,265 @@
+"""
+Serves the boards of several households over HTTP, from a single process.
+
+Each household is a directory under the server's root holding its own tasks.yaml
+and state files. Endpoints (JSON in and out):
+
+    GET  /households                     The households
+    GET  /households/<name>/due?limit=8  The next assigned tasks, and the indefinite tasks
+    GET  /households/<name>/scores       The users' scores
+    POST /households/<name>/complete     {"room": ..., "task": ..., "user": ...}
+                                         Leave out room for an indefinite task, and user
+                                         unless someone else did the task
+    POST /households/<name>/score        {"up": ..., "down": ...} Move a point
+
+Nothing is authenticated, so the server only listens on localhost unless another
+host is given, e.g. "0.0.0.0" to serve the whole network.
+"""
+
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import os
+import threading
+from urllib.parse import parse_qs, urlsplit
+
+import yaml
+
+from . import config
+from .engine import Engine, load_config, get_filepath, TASKS_FILENAME
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8080
+DUE_LIMIT = 8
+
+_log = logging.getLogger(__name__)
+
+
+class Household:
+    """
+    One household's engine, loaded on first use and reloaded when its tasks.yaml
+    changes. Requests to a household are serialised by its lock, so a slow write
+    only holds up that household.
+    """
+    def __init__(self, name, directory):
+        self.name = name
+        self.directory = directory
+        self.lock = threading.Lock()
+        self._engine = None
+        self._signature = None
+
+    def engine(self):
+        """
+        Return the household's engine, up to date with changes other processes
+        made to its state. Call with the lock held.
+        """
+        current = config.signature(get_filepath(TASKS_FILENAME, self.directory))
+        if self._engine is None:
+            self._engine = Engine(directory=self.directory)
+        elif current != self._signature:
+            self._engine.reload(load_config(self.directory))
+        else:
+            self._engine.refresh()
+        self._signature = current
+        return self._engine
+
+    def close(self):
+        """
+        Release the household's state store.
+        """
+        with self.lock:
+            if self._engine:
+                self._engine.close()
+                self._engine = None
+
+
+class Households:
+    """
+    The households under ``root``, each in a directory with a tasks.yaml.
+    """
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        self._households = {}
+
+    def names(self):
+        """
+        Return the names of the households, sorted.
+        """
+        return sorted(name for name in os.listdir(self.root) if self._exists(name))
+
+    def _exists(self, name):
+        return (not name.startswith(".") and os.sep not in name
+                and os.path.isfile(os.path.join(self.root, name, TASKS_FILENAME)))
+
+    def get(self, name):
+        """
+        Return a household by name, or None if there is no such household.
+        """
+        with self._lock:
+            household = self._households.get(name)
+            if household is None and self._exists(name):
+                household = Household(name, os.path.join(self.root, name))
+                self._households[name] = household
+            return household
+
+    def close(self):
+        """
+        Release every household's state store.
+        """
+        with self._lock:
+            households = list(self._households.values())
+        for household in households:
+            household.close()
+
+
+def _task_json(task):
+    return {"room": task.room, "task": task.name, "user": task.user,
+            "due_date": task.due_date.isoformat(), "period": task.period}
+
+
+def _indefinite_task_json(task):
+    return {"task": task.name, "user": task.user, "rep": task.rep,
+            "total_reps": task.total_reps}
+
+
+class _HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _field(body, name):
+    if not isinstance(body.get(name), str):
+        raise ValueError(f"Missing {name}")
+    return body[name]
+
+
+def _due(engine, query, _body):
+    limit = int(query.get("limit", [DUE_LIMIT])[0])
+    return {"tasks": [_task_json(task) for task in engine.assigned_tasks.next_due(limit)],
+            "indefinite_tasks": [_indefinite_task_json(task)
+                                 for task in engine.indefinite_tasks]}
+
+
+def _scores(engine, _query, _body):
+    return {"scores": dict(engine.users.all())}
+
+
+def _complete(engine, _query, body):
+    task = engine.complete(body.get("room"), _field(body, "task"), body.get("user"))
+    if body.get("room") is None:
+        return _indefinite_task_json(task)
+    return _task_json(task)
+
+
+def _score(engine, _query, body):
+    engine.surplus_and_deficit(_field(body, "up"), _field(body, "down"))
+    return {"scores": dict(engine.users.all())}
+
+
+_ROUTES = {
+    ("GET", "due"): _due,
+    ("GET", "scores"): _scores,
+    ("POST", "complete"): _complete,
+    ("POST", "score"): _score,
+}
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    server_version = "cleany"
+
+    def do_GET(self): # pylint: disable=invalid-name
+        """
+        Handle a GET request.
+        """
+        self._handle("GET")
+
+    def do_POST(self): # pylint: disable=invalid-name
+        """
+        Handle a POST request.
+        """
+        self._handle("POST")
+
+    def _handle(self, method):
+        try:
+            self._reply(HTTPStatus.OK, self._dispatch(method))
+        except _HttpError as e:
+            self._reply(e.status, {"error": str(e)})
+
+    def _dispatch(self, method):
+        url = urlsplit(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        if parts == ["households"] and method == "GET":
+            return {"households": self.server.households.names()}
+        if len(parts) != 3 or parts[0] != "households" or (method, parts[2]) not in _ROUTES:
+            raise _HttpError(HTTPStatus.NOT_FOUND, "No such endpoint")
+        household = self.server.households.get(parts[1])
+        if household is None:
+            raise _HttpError(HTTPStatus.NOT_FOUND, f"No such household: {parts[1]}")
+        body = self._read_body() if method == "POST" else {}
+        with household.lock:
+            try:
+                engine = household.engine()
+            except (OSError, ValueError, yaml.YAMLError) as e:
+                _log.exception("Server: failed to load household %s", household.name)
+                raise _HttpError(HTTPStatus.INTERNAL_SERVER_ERROR,
+                                 f"Failed to load {household.name}: {e}") from e
+            try:
+                return _ROUTES[(method, parts[2])](engine, parse_qs(url.query), body)
+            except KeyError as e:
+                raise _HttpError(HTTPStatus.NOT_FOUND, e.args[0]) from e
+            except ValueError as e:
+                raise _HttpError(HTTPStatus.BAD_REQUEST, str(e)) from e
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError as e:
+            raise _HttpError(HTTPStatus.BAD_REQUEST, f"Invalid JSON: {e}") from e
+        if not isinstance(body, dict):
+            raise _HttpError(HTTPStatus.BAD_REQUEST, "Expected a JSON object")
+        return body
+
+    def _reply(self, status, payload):
+        raw = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        _log.info("%s %s", self.address_string(), format % args)
+
+
+class Server(ThreadingHTTPServer):
+    """
+    The HTTP server, handling each request on its own thread.
+    """
+    daemon_threads = True
+
+    def __init__(self, root, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        self.households = Households(root)
+        super().__init__((host, port), _Handler)
+
+    def server_close(self):
+        super().server_close()
+        self.households.close()
+
+
+def serve(root, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """
+    Serve the households under ``root`` until interrupted.
+    """
+    if host not in (DEFAULT_HOST, "localhost", "::1"):
+        _log.warning("Serving on %s: anyone who can reach it can change the state", host)
+    with Server(root, host, port) as server:
+        _log.info("Serving the households in %s on %s:%s", root, host, server.server_port)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,376 @@
+"""
+Storage backends for the persisted collections in data.py.
+
+Several processes may share a state directory (the app, a script, a server).
+Writers hold the directory's StateLock, and each storage can tell whether
+another process changed its files since it last read or wrote them.
+"""
+
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+
+from . import serializers
+
+try:
+    import fcntl
+except ImportError: # Not on Windows, a single process per state directory is assumed there
+    fcntl = None # pylint: disable=invalid-name
+
+JOURNAL_SUFFIX = ".journal"
+CORRUPT_SUFFIX = ".corrupt"
+COMPACT_EVERY = 256
+DEBOUNCE_SECONDS = 0.5
+
+_log = logging.getLogger(__name__)
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def write_file(filename, raw, append=False):
+    """
+    Durably write bytes to a file. Unless appending, they go to a temporary file
+    first, which then atomically replaces the target, so a crash mid-write can
+    never leave a truncated file behind.
+    """
+    target = filename if append else filename + ".tmp"
+    with open(target, "ab" if append else "wb") as f:
+        f.write(raw)
+        f.flush()
+        os.fsync(f.fileno())
+    if not append:
+        os.replace(target, filename)
+
+
+def signature(filename):
+    """
+    Return the inode, size and mtime of a file, or None if it does not exist.
+    An atomic replace changes the inode, an append the size, so any write shows.
+    """
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class StateLock:
+    """
+    An advisory lock (flock) on ``filename``, excluding other processes while held.
+
+    Within the process it is shared: it is taken from the OS when the first hold
+    is acquired, from any thread, and given back when the last is released. Where
+    the filesystem doesn't support locking, it is logged once and ignored.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self._holds = 0
+        self._mutex = threading.Lock()
+        self._file = None
+        self._unsupported = False
+
+    def acquire(self):
+        """
+        Take a hold on the lock, waiting for other processes to release it.
+        """
+        with self._mutex:
+            self._holds += 1
+            if self._holds == 1:
+                self._flock(exclusive=True)
+
+    def release(self):
+        """
+        Give back a hold on the lock.
+        """
+        with self._mutex:
+            self._holds -= 1
+            if self._holds == 0:
+                self._flock(exclusive=False)
+
+    def _flock(self, exclusive):
+        if fcntl is None or self._unsupported:
+            return
+        try:
+            if self._file is None:
+                self._file = open(self.filename, "ab") # pylint: disable=consider-using-with
+            fcntl.flock(self._file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_UN)
+        except OSError:
+            _log.exception("Storage: can't lock %s, writing unlocked", self.filename)
+            self._unsupported = True
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def state_lock(filename):
+    """
+    Return the StateLock of ``filename``, the same one for every caller in the process
+    (flock doesn't exclude a second lock taken by the same process).
+    """
+    path = os.path.realpath(filename)
+    with _locks_lock:
+        if path not in _locks:
+            _locks[path] = StateLock(filename)
+        return _locks[path]
+
+
+class Persister:
+    """
+    A write-behind thread shared by the file storages, keeping disk IO off the UI thread.
+
+    Writes are queued per file and coalesced: a full write replaces whatever was
+    still pending for that file, appends are concatenated. The queue is written
+    out, in order, once no new writes arrived for ``delay`` seconds, or on flush().
+
+    A write queued with a StateLock keeps a hold on it until it is written out, so
+    other processes never read the files with a write of ours still pending.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, delay=DEBOUNCE_SECONDS):
+        self.delay = delay
+        self._pending = {}
+        self._locks = []
+        self._last = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._io = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="cleany-persister", daemon=True)
+        self._thread.start()
+
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def write(self, filename, raw, append=False, lock=None, written=None):
+        """
+        Queue bytes to be written to (or appended to) a file, holding ``lock``
+        until they are. ``written`` is called once they are on disk.
+        """
+        if lock is not None:
+            lock.acquire()
+        with self._cond:
+            if lock is not None:
+                self._locks.append(lock)
+            if append and filename in self._pending:
+                queued_append, queued, _ = self._pending[filename]
+                self._pending[filename] = (queued_append, queued + raw, written)
+            else:
+                # A full write goes to the back of the queue, so it lands after
+                # any files written before it
+                self._pending.pop(filename, None)
+                self._pending[filename] = (append, raw, written)
+            self._last = time.monotonic()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                # Let bursts of changes settle before touching the disk
+                while not self._closed:
+                    wait = self._last + self.delay - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self._cond.wait(wait)
+            self.flush()
+
+    def flush(self):
+        """
+        Write out everything that is still queued, blocking until done.
+        """
+        with self._io:
+            with self._cond:
+                pending, self._pending = self._pending, {}
+                locks, self._locks = self._locks, []
+            try:
+                for filename, (append, raw, written) in pending.items():
+                    try:
+                        write_file(filename, raw, append)
+                    except OSError:
+                        _log.exception("Persister: failed to write %s", filename)
+                        continue
+                    if written:
+                        written()
+            finally:
+                for lock in locks:
+                    lock.release()
+
+    def close(self):
+        """
+        Write out everything that is still queued and stop the thread.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        self.flush()
+
+
+class FileStorage:
+    """
+    Keeps a collection as a JSON snapshot on disk.
+
+    In journal mode, changes are appended as small records to a log next to the
+    snapshot (``<filename>.journal``) instead of rewriting it. The log is folded
+    back into the snapshot once it holds ``compact_every`` records.
+
+    Snapshots are written in the ``state_format`` encoding (see serializers), and
+    read in whichever encoding they were written. Log records are JSON lines,
+    written with orjson if that is the encoding.
+
+    The first line of the log names the CRC32 of the snapshot it applies to, so
+    a log left behind by an interrupted compaction (or by a run without journal
+    mode) is recognised as stale and ignored. A snapshot that can't be read is
+    moved aside, with its log, to ``<filename>.corrupt`` before starting over.
+
+    Writes hold ``lock`` (a StateLock), if given. The signatures of both files are
+    noted when they are read and written, so changed() can tell, with a stat per
+    file, whether anything else wrote them since.
+    """
+
+    # pylint: disable=too-many-instance-attributes,too-many-arguments,too-many-positional-arguments
+    def __init__(self, filename, indent=None, journal=False, compact_every=COMPACT_EVERY,
+                 persister=None, state_format="json", lock=None):
+        self.filename = filename
+        self.indent = indent
+        self.journal = journal
+        self.serializer = serializers.get(state_format)
+        self._lines = serializers.SERIALIZERS[
+            "orjson" if self.serializer.name == "orjson" else "json"]
+        self.compact_every = compact_every
+        self.persister = persister
+        self.lock = lock
+        self.journal_filename = filename + JOURNAL_SUFFIX
+        self._seen = {}
+        self._base = 0
+        self._entries = 0
+        self._fresh = True
+        self._journaled = False # Whether there may be a log to start over, see save()
+
+    def load(self):
+        """
+        Return the stored snapshot (or None) and the changes to replay on top of it.
+        """
+        # Noted before reading, so a write racing the read shows up as a change
+        self._seen = {name: signature(name) for name in (self.filename, self.journal_filename)}
+        self._journaled = self._seen[self.journal_filename] is not None
+        try:
+            with open(self.filename, "rb") as f:
+                raw = f.read()
+        except FileNotFoundError:
+            raw = b""
+        try:
+            doc = serializers.detect(raw).loads(raw) if raw else None
+        except (ValueError, EOFError, TypeError):
+            # Starting over empty would overwrite it, keep it to be recovered by hand
+            _log.exception("Storage: %s is unreadable, moving it to %s and starting over",
+                           self.filename, self.filename + CORRUPT_SUFFIX)
+            self._set_aside()
+            raw, doc = b"", None
+        self._base = zlib.crc32(raw)
+        self._fresh = True # Until a log of this snapshot is found
+        changes = self._read_journal()
+        self._entries = len(changes)
+        return doc, changes
+
+    def _set_aside(self):
+        # Move the snapshot, and the log of changes to it, out of the way
+        for name in (self.filename, self.journal_filename):
+            try:
+                os.replace(name, name + CORRUPT_SUFFIX)
+            except FileNotFoundError:
+                pass
+            self._seen[name] = None
+        self._journaled = False
+
+    def _read_journal(self):
+        try:
+            with open(self.journal_filename, "rb") as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return []
+        if not lines or lines[0] != self._header():
+            return []
+        changes = []
+        for line in lines[1:]:
+            try:
+                changes.append(self._lines.loads(line))
+            except ValueError:
+                break # Torn write at the tail of the log
+        self._fresh = False
+        return changes
+
+    def _header(self):
+        return json.dumps({"base": self._base}).encode("utf-8")
+
+    def changed(self):
+        """
+        Whether the files were written by anything else since they were last read
+        or written here.
+        """
+        return any(signature(name) != seen for name, seen in self._seen.items())
+
+    def _written(self, filename):
+        self._seen[filename] = signature(filename)
+
+    def _write(self, filename, raw, append=False):
+        if self.persister:
+            self.persister.write(filename, raw, append, self.lock,
+                                 functools.partial(self._written, filename))
+            return
+        if self.lock:
+            with self.lock:
+                write_file(filename, raw, append)
+                self._written(filename)
+        else:
+            write_file(filename, raw, append)
+            self._written(filename)
+
+    def flush(self):
+        """
+        Write out the writes still queued with the persister, if any.
+        """
+        if self.persister:
+            self.persister.flush()
+
+    def save(self, doc):
+        """
+        Write the full snapshot, starting the log over.
+        """
+        raw = self.serializer.dumps(doc, self.indent)
+        self._write(self.filename, raw)
+        self._base = zlib.crc32(raw)
+        self._entries = 0
+        self._fresh = True
+        if self.journal or self._journaled:
+            # The old log is based on the snapshot before, which may have had the
+            # same CRC32 as this one, so it must not be left to be replayed on it
+            self._write(self.journal_filename, self._header() + b"\n" if self.journal else b"")
+            self._journaled = self.journal
+            self._fresh = False
+
+    def record(self, changes, dump):
+        """
+        Persist a sequence of changes. ``dump`` returns the full snapshot on demand.
+        """
+        if not self.journal or self._entries + len(changes) > self.compact_every:
+            self.save(dump())
+            return
+        if not changes:
+            return
+        lines = [self._lines.dumps(change) for change in changes]
+        if self._fresh:
+            lines.insert(0, self._header())
+        self._write(self.journal_filename, b"\n".join(lines) + b"\n", append=not self._fresh)
+        self._entries += len(changes)
+        self._fresh = False
@@ -0,0 +1,264 @@
+"""
+A single SQLite database holding all of the app's state, as an alternative to
+the separate rooms/indefinite tasks/users JSON files.
+"""
+
+from contextlib import contextmanager
+import os
+import sqlite3
+
+from . import data
+from .storage import JOURNAL_SUFFIX
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS assigned_tasks (
+    room TEXT NOT NULL,
+    name TEXT NOT NULL,
+    user TEXT NOT NULL,
+    due_date INTEGER NOT NULL,
+    period TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    PRIMARY KEY (room, name)
+);
+CREATE INDEX IF NOT EXISTS assigned_tasks_due ON assigned_tasks (due_date, seq);
+CREATE INDEX IF NOT EXISTS assigned_tasks_user ON assigned_tasks (user);
+CREATE TABLE IF NOT EXISTS indefinite_tasks (
+    name TEXT PRIMARY KEY,
+    user TEXT NOT NULL,
+    rep INTEGER NOT NULL,
+    total_reps INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS users (
+    name TEXT PRIMARY KEY,
+    score INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class _Table:
+    """
+    Storage backend (see storage.FileStorage) mapping the change records of a
+    persisted collection onto the rows of one table.
+    """
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-instance-attributes
+    def __init__(self, store, table, columns, keys, order):
+        self._store = store
+        self._table = table
+        self._columns = columns
+        self._keys = keys
+        self._order = order
+        names = ", ".join(columns)
+        updates = ", ".join(f"{c} = excluded.{c}" for c in columns if c not in keys)
+        self._upsert = (f"INSERT INTO {table} ({names}) VALUES ({', '.join('?' * len(columns))}) "
+                        f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {updates}")
+        self._delete = (f"DELETE FROM {table} WHERE "
+                        + " AND ".join(f"{k} = ?" for k in keys))
+        self._version = None
+
+    def _row(self, item):
+        return tuple(item[c] if c != "seq" else self._store.next_seq() for c in self._columns)
+
+    def _key(self, item):
+        return tuple(item[k] for k in self._keys)
+
+    def load(self):
+        """
+        Return the rows as a snapshot in the collection's JSON layout.
+        """
+        self._version = self._store.data_version()
+        columns = [c for c in self._columns if c != "seq"]
+        rows = self._store.execute(
+            f"SELECT {', '.join(columns)} FROM {self._table} ORDER BY {self._order}")
+        return [dict(zip(columns, row)) for row in rows], []
+
+    def save(self, doc):
+        """
+        Replace every row with the given snapshot.
+        """
+        with self._store.transaction():
+            self._store.execute(f"DELETE FROM {self._table}")
+            self._store.executemany(self._upsert, [self._row(item) for item in doc])
+
+    def record(self, changes, dump):
+        """
+        Apply the collection's change records to the affected rows only.
+        """
+        # pylint: disable=unused-argument
+        with self._store.transaction():
+            for change in changes:
+                self._apply(change)
+
+    def _apply(self, change):
+        op = change[0]
+        if op in ("set", "insert"):
+            self._store.execute(self._upsert, self._row(change[2]))
+        elif op == "del":
+            self._store.execute(self._delete, self._key(change[2]))
+        elif op == "extend":
+            self._store.executemany(self._upsert, [self._row(item) for item in change[1]])
+        elif op == "clear":
+            self._store.execute(f"DELETE FROM {self._table}")
+        elif op == "reset":
+            self.save(change[1])
+
+    def flush(self):
+        """
+        Nothing to write out, changes go straight to the database.
+        """
+
+    def changed(self):
+        """
+        Whether another connection committed to the database since the rows were loaded.
+        """
+        return self._store.data_version() != self._version
+
+
+class _UsersTable(_Table):
+    """
+    The users table, presented to data._Users as a name -> score mapping.
+    """
+    def __init__(self, store):
+        super().__init__(store, "users", ("name", "score"), ("name",), "rowid")
+
+    def load(self):
+        self._version = self._store.data_version()
+        rows = self._store.execute("SELECT name, score FROM users ORDER BY rowid")
+        return dict(rows.fetchall()), []
+
+    def save(self, doc):
+        super().save([{"name": name, "score": score} for name, score in doc.items()])
+
+    def _apply(self, change):
+        op = change[0]
+        if op == "set":
+            self._store.execute(self._upsert, (change[1], change[2]))
+        elif op == "del":
+            self._store.execute(self._delete, (change[1],))
+        elif op == "clear":
+            self._store.execute("DELETE FROM users")
+
+
+class SqliteStore:
+    """
+    All of the app's state in one SQLite database, in WAL mode.
+
+    The collections it hands out behave like their JSON backed counterparts,
+    but each change only touches the affected rows, and changes to several
+    collections can be grouped into a single transaction.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        # Callers serialise access, but may do so from different threads
+        self._conn = sqlite3.connect(filename, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._seq = self._conn.execute(
+            "SELECT COALESCE(MAX(seq), 0) FROM assigned_tasks").fetchone()[0]
+        self._depth = 0
+
+    def execute(self, sql, params=()):
+        """
+        Execute a single statement.
+        """
+        return self._conn.execute(sql, params)
+
+    def executemany(self, sql, params):
+        """
+        Execute a statement for each set of parameters.
+        """
+        return self._conn.executemany(sql, params)
+
+    def data_version(self):
+        """
+        A number that changes whenever another connection commits to the database.
+        """
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def next_seq(self):
+        """
+        Sequence number keeping tasks due on the same day in insertion order.
+        """
+        self._seq += 1
+        return self._seq
+
+    @contextmanager
+    def transaction(self):
+        """
+        Group every change made inside the block into one transaction.
+        Transactions nest; only the outermost one commits.
+        """
+        if self._depth == 0:
+            self._conn.execute("BEGIN")
+        self._depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._depth -= 1
+            if self._depth == 0:
+                self._conn.execute("ROLLBACK")
+            raise
+        self._depth -= 1
+        if self._depth == 0:
+            self._conn.execute("COMMIT")
+
+    def _assigned_tasks_table(self):
+        return _Table(self, "assigned_tasks",
+                      ("user", "room", "name", "due_date", "period", "seq"),
+                      ("room", "name"), "due_date, seq")
+
+    def tasks(self):
+        """
+        The assigned tasks as a list, ordered by due date.
+        """
+        return data.Tasks(self.filename, storage=self._assigned_tasks_table())
+
+    def schedule(self):
+        """
+        The assigned tasks as a data.Schedule.
+        """
+        return data.Schedule(self.filename, storage=self._assigned_tasks_table())
+
+    def indefinite_tasks(self):
+        """
+        The indefinite tasks, ordered by name.
+        """
+        table = _Table(self, "indefinite_tasks", ("user", "name", "rep", "total_reps"),
+                       ("name",), "name")
+        return data.IndefiniteTasks(self.filename, storage=table)
+
+    def users(self):
+        """
+        The users and their scores.
+        """
+        return data.Users(self.filename, storage=_UsersTable(self))
+
+    def migrate(self, rooms_path, it_path, users_path):
+        """
+        Copy the state from the JSON files into the database, once.
+        The JSON files are left in place. Returns True if anything was migrated.
+        """
+        if self.execute("SELECT 1 FROM meta WHERE key = 'migrated'").fetchone():
+            return False
+        paths = (rooms_path, it_path, users_path)
+        migrated = any(os.path.exists(path) or os.path.exists(path + JOURNAL_SUFFIX)
+                       for path in paths)
+        with self.transaction():
+            if migrated:
+                self.tasks().extend(data.Tasks(rooms_path))
+                self.indefinite_tasks().extend(data.IndefiniteTasks(it_path))
+                self.users().set_scores(dict(data.Users(users_path).all()))
+            self.execute("INSERT INTO meta (key, value) VALUES ('migrated', ?)",
+                         (str(migrated),))
+        return migrated
+
+    def close(self):
+        """
+        Close the database connection.
+        """
+        self._conn.close()
@@ -0,0 +1,86 @@
+"""
+A single timer that wakes the app at the next instant anything on screen changes,
+instead of polling on fixed intervals.
+"""
+
+from datetime import date, datetime, time as dtime, timedelta
+import time
+
+# Wake slightly after the instant, so it has certainly passed
+_SLACK = 0.01
+
+
+def next_minute(now):
+    """
+    Unix time of the next minute boundary after ``now``.
+    """
+    return (int(now) // 60 + 1) * 60
+
+
+def midnight(day):
+    """
+    Unix time of the (local) midnight starting ``day``.
+    """
+    return datetime.combine(day, dtime()).timestamp()
+
+
+def next_midnight(now):
+    """
+    Unix time of the next (local) midnight after ``now``.
+    """
+    return midnight(date.fromtimestamp(now) + timedelta(days=1))
+
+
+class Timer:
+    """
+    Runs jobs at computed instants, keeping one timer armed for the earliest of them.
+
+    Each job is a ``next_time(now)`` function returning the unix time it should
+    run next (or None for not at all), and a callback. Call reschedule() when
+    something changed that may move a job's next time.
+
+    :param schedule_once: Arms a one-shot timer, like kivy.clock.Clock.schedule_once
+    """
+    def __init__(self, schedule_once):
+        self._schedule_once = schedule_once
+        self._jobs = []
+        self._event = None
+        self._due = None
+
+    def add(self, next_time, callback):
+        """
+        Add a job.
+        """
+        self._jobs.append([next_time, callback, None])
+
+    def reschedule(self):
+        """
+        Recompute when each job runs next and arm the timer for the earliest.
+        """
+        now = time.time()
+        for job in self._jobs:
+            job[2] = job[0](now)
+        due = min((job[2] for job in self._jobs if job[2] is not None), default=None)
+        if due == self._due and self._event:
+            return
+        self.stop()
+        self._due = due
+        if due is not None:
+            self._event = self._schedule_once(self._fire, max(due - now, 0) + _SLACK)
+
+    def _fire(self, _):
+        self._event = None
+        self._due = None
+        now = time.time()
+        for callback in [job[1] for job in self._jobs if job[2] is not None and job[2] <= now]:
+            callback()
+        self.reschedule()
+
+    def stop(self):
+        """
+        Disarm the timer.
+        """
+        if self._event:
+            self._event.cancel()
+        self._event = None
+        self._due = None
@@ -0,0 +1,471 @@
+"""
+The Cleany Kivy UI
+"""
+from datetime import date, datetime, timedelta
+import logging
+import threading
+
+import kivy
+from kivy.app import App
+from kivy.clock import Clock
+from kivy.uix.boxlayout import BoxLayout
+from kivy.uix.gridlayout import GridLayout
+from kivy.uix.button import Button
+from kivy.uix.label import Label
+from kivy.uix.popup import Popup
+
+from . import weather, storage, config, timer, kiosk, metrics, analytics
+from .engine import Engine, get_filepath, load_config, TASKS_FILENAME, SCHEMA_FILENAME
+
+kivy.require('2.1.0')
+
+NUM_TASKS_DISPLAYED = 8
+FAIRNESS_DAYS = 30
+WEATHER_FILENAME = "weather.json"
+TIME_FMT = "%H:%M"
+DATE_FMT = "%y-%m-%d"
+
+_log = logging.getLogger(__name__)
+
+def _queued_color(due_date):
+    today = datetime.now().date()
+    delta = (due_date - today).days
+    if delta == 0:
+        return (1, 1, 0, 1)
+    if delta < 0:
+        return (1, 0, 0, 1)
+    # if delta > 0
+    return (0, 1, 0, 1)
+
+
+def _sync_children(layout, widgets):
+    # Only re-add the layout's widgets if they changed (children are in reverse order)
+    children = layout.children[::-1]
+    if len(children) != len(widgets) or any(a is not b for a, b in zip(children, widgets)):
+        layout.clear_widgets()
+        for widget in widgets:
+            layout.add_widget(widget)
+
+
+def _configure_metrics(doc):
+    # Timing of the hot paths is opt-in, see metrics
+    if doc.get('metrics'):
+        metrics.enable(get_filepath(metrics.METRICS_FILENAME))
+    else:
+        metrics.disable()
+
+
+class _TaskManager(BoxLayout):
+
+    # pylint: disable=too-many-instance-attributes
+    # More than 7 is fine in this case
+
+    def __init__(self, **kwargs):
+        super().__init__(orientation='vertical', **kwargs)
+
+        # Top layout
+        layout = BoxLayout(orientation='horizontal', size_hint=(1, .9))
+
+        # Right layout
+        self.room_tasks_layout = BoxLayout(orientation='vertical')
+        right_section = BoxLayout(orientation='vertical')
+        self.time_label = Label(text=str(datetime.now().strftime(TIME_FMT)),
+                                    font_size='96sp')
+        self.date_label = Label(text=str(datetime.now().strftime(DATE_FMT)),
+                                    font_size='32sp')
+        self.points_layout = GridLayout(cols=2)
+        self.fairness_layout = GridLayout(cols=2)
+        points_section = BoxLayout(orientation='horizontal')
+        points_section.add_widget(self.points_layout)
+        points_section.add_widget(self.fairness_layout)
+        self.indefinite_tasks_layout = BoxLayout(orientation='vertical')
+        right_section.add_widget(self.time_label)
+        right_section.add_widget(self.date_label)
+        right_section.add_widget(points_section)
+        right_section.add_widget(self.indefinite_tasks_layout)
+
+        layout.add_widget(self.room_tasks_layout)
+        layout.add_widget(right_section)
+
+        # Bottom label
+        self.weather_label = Label(text="Fetching weather...", size_hint=(1, .1))
+
+        # Define popup now for linter
+        self.popup = None
+
+        # Widgets reused across redraws, see _display_users and _display_tasks
+        self._user_headers = [Label(text=header, bold=True)
+                              for header in ["Name", "Surplus/Deficit Points"]]
+        self._user_rows = {}
+        self._fairness_headers = [Label(text=header, bold=True)
+                                  for header in [f"Done ({FAIRNESS_DAYS}d)", "For Others"]]
+        self._fairness_rows = {}
+        # The history's columns, and the events logged while they load, see _watch_history
+        self._history = None
+        self._columns = None
+        self._new_events = []
+        self._task_buttons = []
+        self._indefinite_buttons = {}
+
+        # Writes state files in the background, see CleanyApp.on_pause/on_stop
+        self.persister = storage.Persister()
+
+        # Add top layout and bottom label to the parent layout
+        self.add_widget(layout)
+        self.add_widget(self.weather_label)
+
+        # The state and the task rules, everything on screen reflects it
+        doc = load_config()
+        _configure_metrics(doc)
+        self.engine = Engine(doc, persister=self.persister)
+
+        # Fetches the weather in the background, results are shown on the UI thread
+        self.weather = weather.WeatherFetcher(
+            lambda temp, condition: Clock.schedule_once(
+                lambda _: self._on_weather(temp, condition)),
+            lambda e: Clock.schedule_once(lambda _: self._on_weather_error(e)),
+            weather.WeatherCache(get_filepath(WEATHER_FILENAME)),
+            forecast=self._forecast_weather())
+
+        self._display_users()
+        self._display_tasks()
+
+        # Pick up edits to tasks.yaml, and changes other processes make to the state
+        self.watcher = config.Watcher(
+            get_filepath(TASKS_FILENAME), SCHEMA_FILENAME,
+            lambda new_data: Clock.schedule_once(lambda _: self._reload_yaml(new_data)),
+            poll=self._check_state)
+        self.watcher.start()
+
+        # Wake up only when something on screen is due to change
+        self.timer = timer.Timer(Clock.schedule_once)
+        self.timer.add(timer.next_minute, self._update_time)
+        self.timer.add(timer.next_midnight, self._update_date)
+        self.timer.add(self._next_task_transition, self._display_tasks)
+        self.timer.add(self._next_weather_update, self._update_weather)
+        self._show_cached_weather()
+        self._update_weather()  # Initial weather fetch
+        self.timer.reschedule()
+
+    def _update_time(self):
+        self.time_label.text = str(datetime.now().strftime(TIME_FMT))
+
+    def _update_date(self):
+        self.date_label.text = str(datetime.now().strftime(DATE_FMT))
+        self._display_fairness() # The window moved on
+
+    def _next_task_transition(self, now):
+        # Task colours change at the midnight a task falls due, and the one after
+        today = date.fromtimestamp(now)
+        days = [day for task in self.engine.assigned_tasks.next_due(NUM_TASKS_DISPLAYED)
+                for day in (task.due_date, task.due_date + timedelta(days=1)) if day > today]
+        return timer.midnight(min(days)) if days else None
+
+    def _next_weather_update(self, now):
+        return self.weather.next_fetch(*self._location(), now)
+
+    def _location(self):
+        location = self.engine.data['location']
+        return location['lat'], location['lon']
+
+    def _forecast_weather(self):
+        return self.engine.data.get('weather_mode', 'current') == 'forecast'
+
+    def _show_cached_weather(self):
+        cached = self.weather.cached(*self._location())
+        if cached:
+            self._show_weather(cached[0], cached[1])
+
+    def _update_weather(self):
+        self.weather.fetch(*self._location())
+
+    def _on_weather(self, temp, condition):
+        self._show_weather(temp, condition)
+        self.timer.reschedule()
+
+    def _on_weather_error(self, e):
+        self._show_weather_error(e)
+        self.timer.reschedule()
+
+    def _show_weather(self, temp, condition):
+        self.weather_label.text = f"Temp: {temp}°C\nCondition: {condition}"
+
+    def _show_weather_error(self, e):
+        self.weather_label.text = f"Weather update failed: {e}"
+
+    def shutdown(self):
+        """
+        Stop the background work and write out any pending state.
+        """
+        self.timer.stop()
+        self.watcher.stop()
+        self.weather.stop()
+        self.engine.close()
+        self.persister.close()
+        metrics.disable()
+
+    def pause_background(self):
+        """
+        Pause background work that can wait while nobody is looking, see kiosk.Kiosk.
+        """
+        self.watcher.pause() # Still checks the state, for changes made elsewhere
+
+    def resume_background(self):
+        """
+        Resume the background work paused by pause_background().
+        """
+        self.watcher.resume()
+
+    def _reload_yaml(self, new_data):
+        _configure_metrics(new_data)
+        self.engine.reload(new_data)
+        self.weather.forecast = self._forecast_weather()
+        self._display_users()
+        self._display_tasks()
+        self._update_weather()
+        self.timer.reschedule()
+
+    def _check_state(self):
+        # Called on the watcher thread, only a stat per state file
+        if self.engine.changed():
+            Clock.schedule_once(lambda _: self._reload_state())
+
+    def _reload_state(self):
+        if self.engine.refresh():
+            self._display_users()
+            self._display_tasks()
+            self.timer.reschedule()
+
+    @metrics.timed("ui.display_users")
+    def _display_users(self):
+        # Labels are kept per user, a redraw only updates the points text and colour
+        rows = {}
+        for user, points in self.engine.users.all():
+            row = self._user_rows.get(user) or (Label(text=user), Label())
+            if points == 0:
+                color = "white"
+            elif points > 0:
+                color = "green"
+            else:
+                color = "red"
+            row[1].text = f"{points}"
+            row[1].color = color
+            rows[user] = row
+        self._user_rows = rows
+        _sync_children(self.points_layout,
+                       self._user_headers + [label for row in rows.values() for label in row])
+        self._display_fairness()
+
+    def _watch_history(self, history):
+        # Load the history's columns in the background (parsing the events logged since
+        # they were last cached), then keep them up to date as events are logged
+        self._history = history
+        self._columns = None
+        self._new_events = []
+        if history is None:
+            return
+        history.listeners.append(lambda event, size: self._on_history_event(history, event, size))
+
+        def load():
+            self.persister.flush() # Events logged before listening are written out first
+            columns = analytics.load_columns(history.filename)
+            Clock.schedule_once(lambda _: self._on_columns(history, columns))
+        threading.Thread(target=load, name="cleany-analytics", daemon=True).start()
+
+    def _on_history_event(self, history, event, size):
+        if history is not self._history:
+            return
+        if self._columns is None:
+            self._new_events.append((event, size))
+        else:
+            self._columns.append(event, size)
+
+    def _on_columns(self, history, columns):
+        if history is not self._history:
+            return
+        for event, size in self._new_events:
+            if size > columns.size: # Not written out by the time they were loaded
+                columns.append(event, size)
+        self._columns = columns
+        self._new_events = []
+        self._display_fairness()
+
+    @metrics.timed("ui.display_fairness")
+    def _display_fairness(self):
+        # Who did how much lately, from the history, in the same rows as the points
+        if self.engine.history is not self._history:
+            self._watch_history(self.engine.history)
+        if self._columns is None:
+            _sync_children(self.fairness_layout, [])
+            return
+        since = date.today() - timedelta(days=FAIRNESS_DAYS - 1)
+        stats = {row.user: row for row in analytics.user_stats(
+            self._columns, datetime.combine(since, datetime.min.time()).timestamp())}
+        rows = {}
+        for user, _ in self.engine.users.all():
+            row = self._fairness_rows.get(user) or (Label(), Label())
+            user_stats = stats.get(user)
+            row[0].text = f"{user_stats.done if user_stats else 0}"
+            row[1].text = f"{user_stats.for_others if user_stats else 0}"
+            rows[user] = row
+        self._fairness_rows = rows
+        _sync_children(self.fairness_layout,
+                       self._fairness_headers + [label for row in rows.values() for label in row])
+
+    @metrics.timed("ui.display_tasks")
+    def _display_tasks(self):
+        # Buttons are pooled, a redraw only updates the text and colour of each row
+
+        # Display assigned Tasks
+        tasks = self.engine.assigned_tasks.next_due(NUM_TASKS_DISPLAYED)
+        while len(self._task_buttons) < len(tasks):
+            btn = Button()
+            # pylint: disable=no-member
+            btn.bind(on_press=lambda instance: self._show_confirmation_dialog(instance.task, False))
+            self._task_buttons.append(btn)
+        for btn, task in zip(self._task_buttons, tasks):
+            btn.task = task
+            btn.text = (f"Task: {task.name}\nWho: {task.user}\nWhere: {task.room}"
+                        f"\nDue Date: {task.due_date} ({task.period})")
+            btn.background_color = _queued_color(task.due_date)
+        _sync_children(self.room_tasks_layout, self._task_buttons[:len(tasks)])
+
+        # Display Indefinete tasks
+        buttons = {}
+        for task in self.engine.indefinite_tasks:
+            btn = self._indefinite_buttons.get(task.name)
+            if btn is None:
+                btn = Button()
+                # pylint: disable=no-member
+                btn.bind(on_press=lambda instance:
+                         self._show_confirmation_dialog(instance.task, True, instance))
+            btn.task = task
+            btn.text = f"{task.name}\n{task.user}\n{task.rep}/{task.total_reps}"
+            buttons[task.name] = btn
+        self._indefinite_buttons = buttons
+        _sync_children(self.indefinite_tasks_layout, list(buttons.values()))
+
+    def _different_user_dialog(self, task, indefinite):
+        # Create new popup content
+        content = BoxLayout(orientation='vertical')
+        txt = f"Complete task {task.name} as different user:"
+        content.add_widget(Label(text=txt))
+
+        def complete_task_diff_user(user):
+            self.popup.dismiss()
+            try:
+                self.engine.complete_task_as(task, user, indefinite)
+            except KeyError as e:
+                self._task_gone(e)
+                return
+            self._display_users()
+            if not indefinite:
+                self._task_completed()
+
+        for user in self.engine.find_users_for_task(task, indefinite):
+            if user == task.user:
+                continue
+            content.add_widget(Button
+                               (text=user, on_press=lambda _, u=user: complete_task_diff_user(u)))
+        cancel_button = Button(text="Cancel", on_press=lambda _: self.popup.dismiss())
+        content.add_widget(cancel_button)
+
+        self.popup = Popup(title="Complete task as a different user",
+                           content=content, size_hint=(0.7, 0.5),
+                        auto_dismiss=False)
+        self.popup.open()
+
+    def _show_confirmation_dialog(self, task, indefinite, instance=None):
+        # Create the popup content
+        content = BoxLayout(orientation='vertical')
+        txt = f"{task.user}, are you sure you have completed this task?\n\n{task.name}"
+        if not indefinite:
+            txt = txt + f" in {task.room}"
+        content.add_widget(Label(text=txt))
+
+        # Define the buttons for the dialog
+        cancel_button = Button(text="Cancel", on_press=lambda _: self.popup.dismiss())
+
+        def complete_task(_):
+            self.popup.dismiss()
+            try:
+                if indefinite:
+                    self._complete_indefinite_task(task.name, instance)
+                else:
+                    self._complete_task(task)
+            except KeyError as e:
+                self._task_gone(e)
+        confirm_button = Button(text="Confirm", on_press=complete_task)
+
+        # Add buttons to the content layout
+        content.add_widget(cancel_button)
+        content.add_widget(confirm_button)
+
+        # Add the non-advance task completion button
+        def complete_task_persist_user(_):
+            self.popup.dismiss()
+            self._different_user_dialog(task, indefinite)
+
+
+        persist_user_button = Button(text="Complete task as a different user",
+                                     on_press=complete_task_persist_user)
+        content.add_widget(persist_user_button)
+
+        # Create the popup
+        self.popup = Popup(title="Confirm Task Completion",
+                           content=content,
+                           size_hint=(0.7, 0.5),
+                           auto_dismiss=False)
+
+        # Open the popup
+        self.popup.open()
+
+    def _complete_task(self, task):
+        self.engine.complete_task(task)
+        self._task_completed()
+
+    def _task_completed(self):
+        self._display_tasks()
+        self._display_fairness()
+        self.timer.reschedule() # The displayed tasks changed
+
+    def _task_gone(self, e):
+        # The task or a user was removed (by an edit of tasks.yaml, or another
+        # process) while its dialog was open: show the state as it is now
+        _log.warning("UI: not completed, %s", e)
+        self._display_users()
+        self._display_tasks()
+        self.timer.reschedule()
+
+    def _complete_indefinite_task(self, task_name, instance):
+        task = self.engine.complete_indefinite_task(task_name)
+        instance.text = f"{task.name}\n{task.user}\n{task.rep}/{task.total_reps}"
+        self._display_fairness()
+
+
+class CleanyApp(App):
+    """
+    The Cleany kivy application object. Call CleanyApp().run() to run it.
+    """
+    kiosk = None
+
+    def build(self):
+        return _TaskManager()
+
+    def on_start(self):
+        options = self.root.engine.data.get('kiosk')
+        if options is not None:
+            self.kiosk = kiosk.Kiosk(Clock, self.root_window,
+                                     on_idle=self.root.pause_background,
+                                     on_active=self.root.resume_background, **options)
+            self.kiosk.start()
+
+    def on_pause(self):
+        # Android may kill the app while it is paused, so write out pending state now
+        self.root.persister.flush()
+        return True
+
+    def on_stop(self):
+        if self.kiosk:
+            self.kiosk.stop()
+        self.root.shutdown()
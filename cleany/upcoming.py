@@ -0,0 +1,126 @@
+"""
+Who will have which task when: the future of the current schedule, projected
+with the same rotation rules the engine applies on completion.
+"""
+
+from collections import namedtuple
+from datetime import date, datetime, timezone
+import heapq
+from itertools import islice, takewhile
+
+from .engine import next_user, parse_period, task_users
+
+Occurrence = namedtuple("Occurrence", ["due_date", "room", "task", "user"])
+
+Turn = namedtuple("Turn", ["task", "user", "rep", "total_reps"])
+
+# Lines of an iCalendar file are folded to at most this many octets
+_ICAL_LINE = 75
+
+
+def _task_stream(task, users, today):
+    # The task falls due as scheduled, then every period after it is done, assuming
+    # it is done on the day it falls due (or today, for the overdue occurrence)
+    period = parse_period(task.period)
+    due_date, user = task.due_date, task.user
+    yield Occurrence(due_date, task.room, task.name, user)
+    due_date = max(due_date, today)
+    while True:
+        due_date += period
+        if user in users:
+            user = next_user(users, user)
+        yield Occurrence(due_date, task.room, task.name, user)
+
+
+def occurrences(state, today=None):
+    """
+    Lazily yield the upcoming Occurrences of every assigned task, in due order,
+    forever. Each task is projected on its own, and the streams are merged with
+    a heap, so taking the next k occurrences costs O(k log n) for n tasks,
+    however far ahead they reach.
+
+    :param state: An engine.Engine
+    :param today: The date overdue tasks are assumed to be done, today by default
+    """
+    today = today or date.today()
+    rooms = state.data['rooms']
+    streams = []
+    for task in state.assigned_tasks.ordered():
+        room = rooms[task.room]
+        users = task_users(room, room['tasks'][task.name])
+        streams.append(_task_stream(task, users, today))
+    return heapq.merge(*streams, key=lambda occurrence: occurrence.due_date)
+
+
+def first(stream, number):
+    """
+    The first ``number`` items of a stream.
+    """
+    return islice(stream, number)
+
+
+def until(stream, end):
+    """
+    The occurrences of a stream due before ``end``.
+    """
+    return takewhile(lambda occurrence: occurrence.due_date < end, stream)
+
+
+def turns(task, users):
+    """
+    Lazily yield the upcoming Turns of an indefinite task, forever: the
+    remaining repetitions of its current user, then each next user's.
+    """
+    user, rep = task.user, task.rep
+    while True:
+        yield Turn(task.name, user, rep, task.total_reps)
+        rep += 1
+        if rep > task.total_reps:
+            user, rep = next_user(users, user), 1
+
+
+def _ical_escape(text):
+    return (text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+            .replace("\n", "\\n"))
+
+
+def _ical_line(line):
+    # Fold long lines: continuation lines start with a space (RFC 5545, 3.1)
+    raw = line.encode("utf-8")
+    if len(raw) <= _ICAL_LINE:
+        return line + "\r\n"
+    parts = []
+    while raw:
+        limit = _ICAL_LINE if not parts else _ICAL_LINE - 1
+        cut = min(limit, len(raw))
+        while cut < len(raw) and (raw[cut] & 0xC0) == 0x80:
+            cut -= 1 # Don't split a UTF-8 sequence
+        parts.append(raw[:cut].decode("utf-8"))
+        raw = raw[cut:]
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def write_ical(stream, file):
+    """
+    Write occurrences to a text file as an iCalendar of all-day events, one
+    occurrence at a time. Returns the number of events written.
+    """
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    file.write(_ical_line("BEGIN:VCALENDAR"))
+    file.write(_ical_line("VERSION:2.0"))
+    file.write(_ical_line("PRODID:-//cleany//upcoming tasks//EN"))
+    written = 0
+    for occurrence in stream:
+        day = occurrence.due_date.strftime("%Y%m%d")
+        uid = f"{day}-{occurrence.room}-{occurrence.task}@cleany"
+        for line in ("BEGIN:VEVENT",
+                     f"UID:{_ical_escape(uid)}",
+                     f"DTSTAMP:{stamp}",
+                     f"DTSTART;VALUE=DATE:{day}",
+                     "SUMMARY:" + _ical_escape(
+                         f"{occurrence.user}: {occurrence.task} ({occurrence.room})"),
+                     "END:VEVENT"):
+            file.write(_ical_line(line))
+        written += 1
+    file.write(_ical_line("END:VCALENDAR"))
+    return written
@@ -2,8 +2,25 @@
 Functions for retrieving weather information.
 """
 
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+import json
+import threading
+import time
+
 import requests
 
+from . import metrics
+from .storage import write_file
+
+API_URL = "https://api.open-meteo.com/v1/forecast"
+CACHE_TTL = 600
+BACKOFF_BASE = 30
+BACKOFF_MAX = 3600
+FORECAST_DAYS = 2
+# Refetch the forecast once fewer hours than this are left
+FORECAST_MIN_HORIZON = 6 * 3600
+
 
 _weather_codes = [
     "Cloud development not observed or not observable",
@@ -114,11 +131,15 @@ def _parse_condition(code):
     return _weather_codes[code_int]
 
 
-def get_weather(lat, lon):
+@metrics.timed("weather.get_weather")
+def get_weather(lat, lon, session=None, url=API_URL):
     """
     Get weather based on location 
+
+    :param requests.Session session: Session to reuse connections from (optional)
+    :param str url: The forecast API endpoint
     """
-    response = requests.get("https://api.open-meteo.com/v1/forecast",
+    response = (session or requests).get(url,
     {
         "latitude": lat,
         "longitude": lon,
@@ -129,3 +150,278 @@ def get_weather(lat, lon):
     condition_code = data["current_weather"]["weathercode"]
     condition = _parse_condition(condition_code)
     return temp, condition
+
+
+class Forecast:
+    """
+    An hourly forecast for one location, kept as a compact time series.
+
+    :param int start: Unix time of the first hour
+    """
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def __init__(self, lat, lon, start, temps, codes):
+        self.lat = lat
+        self.lon = lon
+        self.start = start
+        self.temps = array("f", temps)
+        self.codes = array("B", codes)
+
+    def hour(self, when):
+        """
+        Index of the hour containing ``when``, or None if outside the forecast.
+        """
+        i = int((when - self.start) // 3600)
+        return i if 0 <= i < len(self.temps) else None
+
+    def at(self, when):
+        """
+        Return the forecast (temp, condition) for the hour containing ``when``, or None.
+        """
+        i = self.hour(when)
+        if i is None:
+            return None
+        return round(self.temps[i], 1), _parse_condition(self.codes[i])
+
+    def horizon(self, when):
+        """
+        Seconds of forecast left after ``when``.
+        """
+        return max(self.start + 3600 * len(self.temps) - when, 0)
+
+
+@metrics.timed("weather.get_forecast")
+def get_forecast(lat, lon, session=None, url=API_URL, days=FORECAST_DAYS):
+    """
+    Get the hourly forecast based on location
+
+    :param requests.Session session: Session to reuse connections from (optional)
+    :param str url: The forecast API endpoint
+    :param int days: How many days ahead to fetch
+    """
+    response = (session or requests).get(url,
+    {
+        "latitude": lat,
+        "longitude": lon,
+        "hourly": "temperature_2m,weathercode",
+        "forecast_days": days,
+        "timeformat": "unixtime"
+    }, timeout=5)
+    hourly = response.json()["hourly"]
+    temps = []
+    codes = []
+    # The series ends at the first hour without data
+    for temp, code in zip(hourly["temperature_2m"], hourly["weathercode"]):
+        if temp is None or code is None:
+            break
+        temps.append(temp)
+        codes.append(int(code))
+    return Forecast(lat, lon, hourly["time"][0], temps, codes)
+
+
+class WeatherCache:
+    """
+    The last good weather reading, persisted to ``filename`` so it can be shown
+    right away after a restart, along with the backoff state after failed fetches.
+
+    A reading is fresh for ``ttl`` seconds. After a failure no new fetch is due
+    for BACKOFF_BASE seconds, doubling with every further failure up to BACKOFF_MAX.
+    """
+    def __init__(self, filename, ttl=CACHE_TTL):
+        self.filename = filename
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._retry_at = 0
+        try:
+            with open(filename, "r", encoding="utf-8") as f:
+                self._entry = json.load(f)
+        except (OSError, ValueError):
+            self._entry = None
+
+    def get(self, lat, lon):
+        """
+        Return the cached (temp, condition, fetched_at) for a location, or None.
+        """
+        with self._lock:
+            entry = self._entry
+        if not entry or (entry["lat"], entry["lon"]) != (lat, lon):
+            return None
+        return entry["temp"], entry["condition"], entry["fetched_at"]
+
+    def due(self, lat, lon, now=None):
+        """
+        Whether the cached reading has expired and we are not backing off.
+        """
+        now = time.time() if now is None else now
+        cached = self.get(lat, lon)
+        if self.backing_off(now):
+            return False
+        return cached is None or now - cached[2] >= self.ttl
+
+    def expires(self, lat, lon):
+        """
+        Unix time the cached reading for a location expires, or None without one.
+        """
+        cached = self.get(lat, lon)
+        return cached[2] + self.ttl if cached else None
+
+    def retry_at(self):
+        """
+        Unix time fetching may resume after failures.
+        """
+        with self._lock:
+            return self._retry_at
+
+    def backing_off(self, now=None):
+        """
+        Whether fetching is on hold after failures.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            return now < self._retry_at
+
+    def store(self, lat, lon, temp, condition, now=None):
+        """
+        Save a good reading, ending any backoff.
+        """
+        entry = {"lat": lat, "lon": lon, "temp": temp, "condition": condition,
+                 "fetched_at": time.time() if now is None else now}
+        with self._lock:
+            self._entry = entry
+            self._failures = 0
+            self._retry_at = 0
+        try:
+            write_file(self.filename, json.dumps(entry).encode("utf-8"))
+        except OSError:
+            pass # The reading is still cached in memory
+
+    def failed(self, now=None):
+        """
+        Record a failed fetch, backing off exponentially.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            self._failures += 1
+            self._retry_at = now + min(BACKOFF_BASE * 2 ** (self._failures - 1), BACKOFF_MAX)
+
+
+class WeatherFetcher:
+    """
+    Fetches the weather on a worker thread over a pooled session, so the
+    caller never blocks on the network. Results are handed to ``on_result(temp,
+    condition)`` or ``on_error(exception)`` on the worker thread.
+
+    With a WeatherCache, fetches only go out once the cached reading has
+    expired (and not while backing off), and errors are only reported when
+    there is no cached reading to fall back on.
+
+    In ``forecast`` mode the hourly forecast is fetched instead, and each
+    fetch() serves the current hour from it (calling ``on_result`` when the
+    hour changes). The network is only used when less than
+    FORECAST_MIN_HORIZON of forecast is left.
+    """
+
+    # pylint: disable=too-many-instance-attributes,too-many-arguments,too-many-positional-arguments
+    def __init__(self, on_result, on_error, cache=None, url=API_URL, forecast=False):
+        self.on_result = on_result
+        self.on_error = on_error
+        self.cache = cache
+        self.url = url
+        self.forecast = forecast
+        self._forecast = None
+        self._shown_hour = None
+        self._session = requests.Session()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cleany-weather")
+        self._lock = threading.Lock()
+        self._pending = None
+        self._stopped = False
+
+    def fetch(self, lat, lon):
+        """
+        Start fetching the weather, unless a fetch is already in flight.
+        Returns whether a new fetch was started.
+        """
+        if self.forecast:
+            if self._serve_forecast(lat, lon) >= FORECAST_MIN_HORIZON:
+                return False
+            if self.cache and self.cache.backing_off():
+                return False
+        elif self.cache and not self.cache.due(lat, lon):
+            return False
+        with self._lock:
+            if self._stopped or (self._pending and not self._pending.done()):
+                return False
+            self._pending = self._executor.submit(self._run, lat, lon)
+            return True
+
+    def next_fetch(self, lat, lon, now=None):
+        """
+        Unix time fetch() will next have something to do: start a fetch,
+        or serve a new hour of the forecast.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            if self._pending and not self._pending.done():
+                return now + 5 # Check back once the request timed out at the latest
+        forecast = self._forecast
+        if self.forecast and forecast and (forecast.lat, forecast.lon) == (lat, lon):
+            hour = forecast.hour(now)
+            refetch = forecast.start + 3600 * len(forecast.temps) - FORECAST_MIN_HORIZON
+            if self.cache:
+                refetch = max(refetch, self.cache.retry_at())
+            if hour is None:
+                # Nothing to serve until the next fetch, which may be backing off
+                return refetch
+            return min(forecast.start + 3600 * (hour + 1), refetch)
+        if not self.cache:
+            return now + CACHE_TTL
+        return max(self.cache.expires(lat, lon) or now, self.cache.retry_at())
+
+    def cached(self, lat, lon):
+        """
+        Return the cached (temp, condition, fetched_at) for a location, or None.
+        """
+        return self.cache.get(lat, lon) if self.cache else None
+
+    def _serve_forecast(self, lat, lon):
+        # Hand out the current hour of the forecast, returning how much of it is left
+        forecast = self._forecast
+        if not forecast or (forecast.lat, forecast.lon) != (lat, lon):
+            return 0
+        now = time.time()
+        hour = forecast.hour(now)
+        if hour is not None and hour != self._shown_hour and not self._stopped:
+            self._shown_hour = hour
+            self.on_result(*forecast.at(now))
+        return forecast.horizon(now)
+
+    def _run(self, lat, lon):
+        try:
+            if self.forecast:
+                self._forecast = get_forecast(lat, lon, self._session, self.url)
+                self._shown_hour = None
+                result = self._forecast.at(time.time())
+            else:
+                result = get_weather(lat, lon, self._session, self.url)
+        except (requests.exceptions.RequestException, KeyError, IndexError, ValueError) as e:
+            if self.cache:
+                self.cache.failed()
+            if not self._stopped and not self.cached(lat, lon):
+                self.on_error(e)
+            return
+        if self.cache and result:
+            self.cache.store(lat, lon, *result)
+        if self.forecast:
+            self._serve_forecast(lat, lon)
+        elif not self._stopped:
+            self.on_result(*result)
+
+    def stop(self):
+        """
+        Cancel any fetch in flight (its result is discarded) and release the session.
+        """
+        with self._lock:
+            self._stopped = True
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._session.close()
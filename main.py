@@ -3,8 +3,105 @@ Entry point for the application
 """
 
 import argparse
+from datetime import date, datetime, timedelta
+import logging
+import os
+import sys
+
+import cleany
+from cleany import schema, metrics, upcoming, analytics, history, TASKS_FILENAME, SCHEMA_FILENAME
+from cleany.engine import get_filepath
+
+
+def _status(engine):
+    for task in engine.assigned_tasks.ordered():
+        print(f"{task.due_date}  {task.room}: {task.name} ({task.period}) - {task.user}")
+    print()
+    for task in engine.indefinite_tasks:
+        print(f"{task.name}: {task.user} {task.rep}/{task.total_reps}")
+    print()
+    for user, points in engine.users.all():
+        print(f"{user}: {points}")
+
+
+def _complete(engine, options):
+    room = options.room if options.command == "complete" else None
+    try:
+        engine.complete(room, options.task, options.user)
+    except (KeyError, ValueError) as e:
+        sys.exit(e.args[0])
+
+
+def _upcoming(engine, options):
+    stream = upcoming.occurrences(engine)
+    if options.weeks:
+        stream = upcoming.until(stream, date.today() + timedelta(weeks=options.weeks))
+    else:
+        stream = upcoming.first(stream, options.count)
+    if options.ical:
+        with open(options.ical, "w", encoding="utf-8", newline="") as file:
+            print(f"Wrote {upcoming.write_ical(stream, file)} events to {options.ical}")
+        return
+    for occurrence in stream:
+        print(f"{occurrence.due_date}  {occurrence.room}: {occurrence.task} - {occurrence.user}")
+    print()
+    for task in engine.indefinite_tasks:
+        users = engine.find_users_for_task(task, True)
+        turns = upcoming.first(upcoming.turns(task, users), task.total_reps * len(users))
+        print(f"{task.name}: " + ", ".join(f"{t.user} {t.rep}/{t.total_reps}" for t in turns))
+
+
+def _history(engine, options):
+    if engine.history is None:
+        sys.exit(f"No history is kept, set 'history: true' in {TASKS_FILENAME}")
+    for event in engine.history.events(options.user, options.room, options.task,
+                                       options.limit):
+        when = datetime.fromtimestamp(event["at"]).strftime("%Y-%m-%d %H:%M")
+        if event["kind"] == "score":
+            print(f"{when}  {event['credited']} +1, {event['user']} -1")
+            continue
+        what = f"{event['room']}: {event['task']}" if event["room"] else event["task"]
+        if event["kind"] == "assign":
+            due = date.fromordinal(event["next_due"])
+            print(f"{when}  {what} - assigned to {event['user']}, due {due}")
+            continue
+        by = event["credited"]
+        if by != event["user"]:
+            by += f" for {event['user']}"
+        print(f"{when}  {what} - {by}")
+
+
+def _report(options):
+    filename = get_filepath(history.HISTORY_FILENAME)
+    if not os.path.exists(filename):
+        sys.exit(f"No {history.HISTORY_FILENAME} yet, set 'history: true' in {TASKS_FILENAME}")
+    columns = analytics.load_columns(filename)
+    since = options.since or (None if options.days is None else
+                              date.today() - timedelta(days=options.days - 1))
+    start = since and datetime.combine(since, datetime.min.time()).timestamp()
+    end = options.until and datetime.combine(options.until + timedelta(days=1),
+                                             datetime.min.time()).timestamp()
+    print(f"{'user':24} {'done':>6} {'for others':>11} {'covered':>8}")
+    for row in analytics.user_stats(columns, start, end):
+        print(f"{row.user:24} {row.done:6} {row.for_others:11} {row.covered:8}")
+    print()
+    print(f"{'room':24} {'done':>6} {'on time':>8} {'overdue':>8} {'on time %':>10} "
+          f"{'days late':>10}")
+    for row in analytics.room_stats(columns, start, end):
+        print(f"{row.room:24} {row.done:6} {row.on_time:8} {row.overdue:8} "
+              f"{row.on_time_rate * 100:10.1f} {row.avg_days_late:10.2f}")
+
+
+def _stats():
+    doc = metrics.load(get_filepath(metrics.METRICS_FILENAME))
+    if doc is None:
+        sys.exit(f"No {metrics.METRICS_FILENAME} yet, set 'metrics: true' in {TASKS_FILENAME}")
+    print(f"{'':32} {'count':>8} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}")
+    for name, calls, p50, p95, slowest in metrics.summary(doc):
+        print(f"{name:32} {calls:8} {p50 * 1000:9.2f} {p95 * 1000:9.2f} {slowest * 1000:9.2f}")
+    for name, value in sorted(doc.get("counters", {}).items()):
+        print(f"{name:32} {value:8}")
 
-from cleany import CleanyApp, schema, TASKS_FILENAME, SCHEMA_FILENAME
 
 if __name__ == "__main__":
 
@@ -12,9 +109,72 @@ if __name__ == "__main__":
     subparsers = parser.add_subparsers(dest="command", required=False)
     subparsers.add_parser("run", help="Run the program.")
     subparsers.add_parser("validate", help="Validate the tasks.yaml file.")
+    subparsers.add_parser("status", help="Show the assigned tasks and the scores.")
+    subparsers.add_parser("stats", help="Show the timings recorded with 'metrics: true'.")
+    history_parser = subparsers.add_parser("history", help="Show who completed what, newest "
+                                           "first (with 'history: true').")
+    history_parser.add_argument("--user")
+    history_parser.add_argument("--room")
+    history_parser.add_argument("--task")
+    history_parser.add_argument("--limit", type=int, default=20)
+    report_parser = subparsers.add_parser("report", help="Show completions per user and "
+                                          "lateness per room (with 'history: true').")
+    report_parser.add_argument("--days", type=int, default=30,
+                               help="Report on this many days up to today.")
+    report_parser.add_argument("--since", type=date.fromisoformat,
+                               help="Report from this date (YYYY-MM-DD) instead.")
+    report_parser.add_argument("--until", type=date.fromisoformat,
+                               help="Report up to this date, inclusive.")
+    report_parser.add_argument("--all", dest="days", action="store_const", const=None,
+                               help="Report on the whole history.")
+    upcoming_parser = subparsers.add_parser("upcoming", help="Show who has which task next.")
+    upcoming_parser.add_argument("--count", type=int, default=20,
+                                 help="How many occurrences to show.")
+    upcoming_parser.add_argument("--weeks", type=int,
+                                 help="Show all occurrences this many weeks ahead instead.")
+    upcoming_parser.add_argument("--ical", help="Write them to this iCalendar file instead.")
+    serve_parser = subparsers.add_parser(
+        "serve", help="Serve several households over HTTP, see cleany/server.py.")
+    serve_parser.add_argument("root", help="Directory with a subdirectory per household, "
+                              "each holding its tasks.yaml and state.")
+    serve_parser.add_argument("--host", default="127.0.0.1",
+                              help="Address to listen on, localhost by default. Requests "
+                              "are not authenticated, give 0.0.0.0 to serve the network "
+                              "anyway.")
+    serve_parser.add_argument("--port", type=int, default=8080)
+    complete_parser = subparsers.add_parser("complete", help="Complete an assigned task.")
+    complete_parser.add_argument("room")
+    complete_parser.add_argument("task")
+    indefinite_parser = subparsers.add_parser("complete-indefinite",
+                                              help="Complete an indefinite task.")
+    indefinite_parser.add_argument("task")
+    for subparser in (complete_parser, indefinite_parser):
+        subparser.add_argument("--as", dest="user",
+                               help="The user who did it, if not the assigned one.")
     args = parser.parse_args()
 
     if args.command is None or args.command == "run":
-        CleanyApp().run()
+        cleany.CleanyApp().run()
     elif args.command == "validate":
         schema.validate(TASKS_FILENAME, SCHEMA_FILENAME)
+    elif args.command == "stats":
+        _stats()
+    elif args.command == "report":
+        _report(args)
+    elif args.command == "serve":
+        from cleany import server # pylint: disable=import-outside-toplevel
+        logging.basicConfig(level=logging.INFO)
+        server.serve(args.root, args.host, args.port)
+    else:
+        state = cleany.Engine()
+        try:
+            if args.command == "status":
+                _status(state)
+            elif args.command == "upcoming":
+                _upcoming(state, args)
+            elif args.command == "history":
+                _history(state, args)
+            else:
+                _complete(state, args)
+        finally:
+            state.close()
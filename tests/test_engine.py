@@ -0,0 +1,110 @@
+"""
+Completing tasks on behalf of others, with each storage mode.
+"""
+
+from datetime import date, datetime
+
+import pytest
+
+from cleany.engine import Engine
+
+SEEDED = datetime(2025, 1, 1, 12)
+NOW = datetime(2025, 1, 4, 12)
+STORAGES = ("json", "journal", "sqlite")
+
+
+def _engine(directory, storage, now=NOW):
+    config = {
+        "rooms": {"kitchen": {"users": ["alex", "ryan"],
+                              "tasks": {"clean_sink": "1w", "mop_floor": "2w"}}},
+        "indefinite_tasks": {"trash": {"users": ["alex", "ryan"], "repetitions": 2}},
+        "storage": storage,
+        "history": True,
+    }
+    return Engine(config, now=lambda: now, directory=str(directory))
+
+
+def _state(engine):
+    return ([(t.user, t.room, t.name, t.due_date) for t in engine.assigned_tasks.ordered()],
+            [(t.user, t.name, t.rep) for t in engine.indefinite_tasks],
+            dict(engine.users.all()), len(engine.history))
+
+
+@pytest.mark.parametrize("storage", STORAGES)
+def test_complete_task_as(tmp_path, storage):
+    """
+    The task is rescheduled for its assignee, who owes the user who did it a point.
+    """
+    _engine(tmp_path, storage, SEEDED).close()
+    engine = _engine(tmp_path, storage)
+    task = engine.assigned_tasks[("kitchen", "clean_sink")]
+    engine.complete_task_as(task, "ryan", False)
+
+    done = engine.assigned_tasks[("kitchen", "clean_sink")]
+    assert (done.user, done.due_date) == ("alex", date(2025, 1, 11))
+    assert dict(engine.users.all()) == {"alex": -1, "ryan": 1}
+    assert engine.history.events(limit=1)[0]["credited"] == "ryan"
+    expected = _state(engine)
+    engine.close()
+
+    assert _state(_engine(tmp_path, storage)) == expected
+
+
+@pytest.mark.parametrize("storage", STORAGES)
+def test_complete_task_as_unknown_user(tmp_path, storage):
+    """
+    Completing a task as someone who isn't a user changes nothing.
+    """
+    engine = _engine(tmp_path, storage)
+    before = _state(engine)
+    task = engine.assigned_tasks[("kitchen", "clean_sink")]
+    with pytest.raises(KeyError):
+        engine.complete_task_as(task, "nobody", False)
+
+    assert _state(engine) == before
+    engine.close()
+    assert _state(_engine(tmp_path, storage)) == before
+
+
+@pytest.mark.parametrize("indefinite", [False, True])
+@pytest.mark.parametrize("storage", STORAGES)
+def test_complete_task_as_is_atomic(tmp_path, monkeypatch, storage, indefinite):
+    """
+    If moving the point fails, the rescheduled task is rolled back with it,
+    in memory and on disk.
+    """
+    _engine(tmp_path, storage, SEEDED).close()
+    engine = _engine(tmp_path, storage)
+    before = _state(engine)
+
+    def fail(up, down):
+        raise RuntimeError(f"{up}, {down}")
+
+    monkeypatch.setattr(engine.users, "up_and_down", fail)
+    if indefinite:
+        task = engine.indefinite_tasks.find("trash")
+    else:
+        task = engine.assigned_tasks[("kitchen", "clean_sink")]
+    with pytest.raises(RuntimeError):
+        engine.complete_task_as(task, "ryan", indefinite)
+
+    assert _state(engine) == before
+    engine.close()
+    assert _state(_engine(tmp_path, storage)) == before
+
+
+@pytest.mark.parametrize("storage", STORAGES)
+def test_complete_removed_task(tmp_path, storage):
+    """
+    Completing a task that was removed since it was shown raises KeyError.
+    """
+    engine = _engine(tmp_path, storage)
+    task = engine.assigned_tasks[("kitchen", "mop_floor")]
+    data = dict(engine.data)
+    data["rooms"] = {"kitchen": {"users": ["alex", "ryan"], "tasks": {"clean_sink": "1w"}}}
+    engine.reload(data)
+
+    with pytest.raises(KeyError):
+        engine.complete_task(task)
+    with pytest.raises(KeyError):
+        engine.complete_task_as(task, "ryan", False)
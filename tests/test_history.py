@@ -0,0 +1,91 @@
+"""
+Queries of the completion history, from the log and from its snapshot.
+"""
+
+from datetime import date
+
+import pytest
+
+from cleany import history
+
+
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments
+def _record(log, at, kind, room, task, user, credited):
+    # With the resulting state of the task, as the engine logs it
+    if kind == "indefinite":
+        result = {"next_user": user, "rep": 1}
+    elif kind == "task":
+        result = {"next_user": user, "next_due": date(2025, 1, 1).toordinal() + at, "period": "1w"}
+    else:
+        result = {}
+    log.record(kind, at, room, task, user, credited, **result)
+
+
+def _log(directory):
+    log = history.History(str(directory / history.HISTORY_FILENAME))
+    events = [
+        ("task", "kitchen", "clean_sink", "alex", "alex"),
+        ("task", "kitchen", "mop_floor", "ryan", "alex"),
+        ("task", "hallway", "clean_sink", "ryan", "ryan"),
+        ("indefinite", None, "trash", "alex", "alex"),
+        ("score", None, None, "ryan", "alex"),
+        ("task", "kitchen", "clean_sink", "ryan", "ryan"),
+    ]
+    for at, (kind, room, task, user, credited) in enumerate(events):
+        _record(log, at, kind, room, task, user, credited)
+    return log
+
+
+def _times(events):
+    return [event["at"] for event in events]
+
+
+@pytest.mark.parametrize("query, expected", [
+    ({}, [5, 4, 3, 2, 1, 0]),
+    ({"user": "alex"}, [4, 3, 1, 0]),
+    ({"user": "ryan"}, [5, 4, 2, 1]),
+    ({"room": "kitchen"}, [5, 1, 0]),
+    ({"room": "kitchen", "task": "clean_sink"}, [5, 0]),
+    ({"room": "hallway", "task": "clean_sink"}, [2]),
+    ({"task": "trash"}, [3]),
+    ({"user": "alex", "room": "kitchen"}, [1, 0]),
+    ({"user": "alex", "room": "kitchen", "task": "clean_sink"}, [0]),
+    ({"user": "nobody"}, []),
+    ({"room": "attic"}, []),
+    ({"limit": 2}, [5, 4]),
+    ({"user": "ryan", "limit": 1}, [5]),
+])
+def test_events(tmp_path, query, expected):
+    """
+    Events are filtered by user, room and task, newest first.
+    """
+    assert _times(_log(tmp_path).events(**query)) == expected
+
+
+def test_events_from_snapshot(tmp_path):
+    """
+    The snapshot restores the indexes, and later events are indexed on top of it.
+    """
+    log = _log(tmp_path)
+    log.snapshot()
+    _record(log, 6, "task", "kitchen", "mop_floor", "alex", "alex")
+    queries = ({"user": "alex"}, {"room": "kitchen"}, {"room": "kitchen", "task": "mop_floor"})
+    expected = [_times(log.events(**query)) for query in queries]
+    assert expected[1] == [6, 5, 1, 0]
+
+    reloaded = history.History(log.filename)
+    assert [_times(reloaded.events(**query)) for query in queries] == expected
+    assert reloaded.scores() == log.scores()
+
+
+def test_refresh(tmp_path):
+    """
+    Events appended by another writer are picked up and indexed by refresh().
+    """
+    log = _log(tmp_path)
+    other = history.History(log.filename)
+    _record(other, 6, "task", "hallway", "clean_sink", "alex", "alex")
+
+    assert log.refresh()
+    assert _times(log.events(room="hallway")) == [6, 2]
+    assert not log.refresh()
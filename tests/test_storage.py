@@ -0,0 +1,157 @@
+"""
+Round-trips of the persisted collections through each storage mode, and replay
+of the journal.
+"""
+
+from datetime import date
+
+import pytest
+
+from cleany import data, serializers, storage
+from cleany.store import SqliteStore
+
+TODAY = date(2025, 1, 1)
+
+
+def _tasks():
+    return [data.new_task("alex", "kitchen", "clean_sink", TODAY, "1w"),
+            data.new_task("ryan", "kitchen", "mop_floor", TODAY, "2w"),
+            data.new_task("alex", "hallway", "sweep_floor", date(2025, 1, 3), "1w")]
+
+
+def _fill(schedule, indefinite, users):
+    for task in _tasks():
+        schedule.add(task)
+    indefinite.append(data.new_indefinite_task("ryan", "trash", 3))
+    users.set_scores({"alex": 1, "ryan": -1})
+
+
+def _state(schedule, indefinite, users):
+    return ([(t.user, t.room, t.name, t.due_date, t.period) for t in schedule.ordered()],
+            [(t.user, t.name, t.rep, t.total_reps) for t in indefinite],
+            dict(users.all()))
+
+
+def _files(directory, **options):
+    return (data.Schedule(str(directory / "rooms.json"), **options),
+            data.IndefiniteTasks(str(directory / "it.json"), **options),
+            data.Users(str(directory / "users.json"), **options))
+
+
+@pytest.mark.parametrize("journal", [False, True])
+@pytest.mark.parametrize("state_format", serializers.available())
+def test_file_round_trip(tmp_path, journal, state_format):
+    """
+    The state files read back what was written, in each encoding, with and without a journal.
+    """
+    options = {"journal": journal, "state_format": state_format}
+    collections = _files(tmp_path, **options)
+    _fill(*collections)
+    schedule, indefinite, users = collections
+    schedule.remove(schedule[("kitchen", "mop_floor")])
+    indefinite.increment("trash")
+    users.up_and_down("ryan", "alex")
+    expected = _state(*collections)
+
+    assert _state(*_files(tmp_path, **options)) == expected
+
+
+def test_sqlite_round_trip(tmp_path):
+    """
+    The database reads back what was written.
+    """
+    filename = str(tmp_path / "cleany.db")
+    db = SqliteStore(filename)
+    collections = (db.schedule(), db.indefinite_tasks(), db.users())
+    _fill(*collections)
+    collections[1].increment("trash")
+    expected = _state(*collections)
+    db.close()
+
+    db = SqliteStore(filename)
+    assert _state(db.schedule(), db.indefinite_tasks(), db.users()) == expected
+    db.close()
+
+
+def test_persister_round_trip(tmp_path):
+    """
+    Writes queued with the persister are all on disk once it is closed.
+    """
+    persister = storage.Persister(delay=60)
+    collections = _files(tmp_path, journal=True, persister=persister)
+    _fill(*collections)
+    expected = _state(*collections)
+    persister.close()
+
+    assert _state(*_files(tmp_path, journal=True)) == expected
+
+
+def test_journal_replay(tmp_path):
+    """
+    Changes only appended to the journal are replayed on load.
+    """
+    filename = str(tmp_path / "users.json")
+    users = data.Users(filename, journal=True)
+    users.set_scores({"alex": 0, "ryan": 0})
+    users.up_and_down("alex", "ryan")
+
+    # Only the log was appended to since the first change
+    with open(filename + storage.JOURNAL_SUFFIX, "rb") as f:
+        assert len(f.read().splitlines()) > 1
+    assert dict(data.Users(filename, journal=True).all()) == {"alex": 1, "ryan": -1}
+
+
+def test_journal_compaction(tmp_path):
+    """
+    A full journal is folded into the snapshot.
+    """
+    filename = str(tmp_path / "users.json")
+    users = data.Users(filename, journal=True, compact_every=2)
+    for score in range(5):
+        users.set_scores({"alex": score})
+
+    assert dict(data.Users(filename, journal=True, compact_every=2).all()) == {"alex": 4}
+    assert dict(data.Users(filename).all()) == {"alex": 4}
+
+
+def test_torn_journal_tail(tmp_path):
+    """
+    A record torn at the end of the journal is ignored.
+    """
+    filename = str(tmp_path / "users.json")
+    users = data.Users(filename, journal=True)
+    users.set_scores({"alex": 0})
+    users.set_scores({"alex": 1})
+    with open(filename + storage.JOURNAL_SUFFIX, "ab") as f:
+        f.write(b'["set", "alex"')
+
+    assert dict(data.Users(filename, journal=True).all()) == {"alex": 1}
+
+
+@pytest.mark.parametrize("journal", [False, True])
+def test_stale_journal_is_not_replayed(tmp_path, journal):
+    """
+    A journal left behind is not replayed on a snapshot written since, even one
+    with the same contents (and so the same CRC32) it was based on.
+    """
+    filename = str(tmp_path / "users.json")
+    data.Users(filename).set_scores({"alex": 0})
+    data.Users(filename, journal=True).set_scores({"alex": 1})
+
+    users = data.Users(filename, journal=journal, compact_every=0)
+    users.set_scores({"alex": 0})
+
+    assert dict(data.Users(filename, journal=True).all()) == {"alex": 0}
+
+
+def test_unreadable_snapshot_is_moved_aside(tmp_path):
+    """
+    An unreadable snapshot is kept for recovery rather than overwritten.
+    """
+    filename = str(tmp_path / "users.json")
+    with open(filename, "wb") as f:
+        f.write(b"{not json")
+
+    assert not dict(data.Users(filename).all())
+    with open(filename + storage.CORRUPT_SUFFIX, "rb") as f:
+        assert f.read() == b"{not json"